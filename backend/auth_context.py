@@ -0,0 +1,115 @@
+# Authentication Context for HayvanPazarı
+from fastapi import HTTPException, Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import Dict, Any, Optional, Set
+from datetime import datetime, timedelta
+import os
+import time
+import uuid
+
+import jwt
+
+from ttl_cache import TTLCache
+
+# JWT Configuration
+JWT_SECRET = "hayvan-pazari-secret-key-2025"
+JWT_ALGORITHM = "HS256"
+JWT_EXPIRATION_TIME = timedelta(days=7)
+
+# Verified claims per token; an entry never outlives its token
+CLAIMS_CACHE_SECONDS = 300
+claims_cache = TTLCache(maxsize=20000, ttl_seconds=CLAIMS_CACHE_SECONDS)
+# Projected current-user documents (no password, no _id)
+USER_PROJECTION = {"_id": 0, "password": 0}
+profile_cache = TTLCache(maxsize=20000, ttl_seconds=CLAIMS_CACHE_SECONDS)
+
+# jti values of logged-out tokens, mirrored from db.revoked_tokens
+revoked_jtis: Set[str] = set()
+
+# Tokens issued before jti existed cannot be revoked; they stay valid until their exp
+# (at most JWT_EXPIRATION_TIME) unless JWT_REQUIRE_JTI_AFTER (ISO date) has passed
+REQUIRE_JTI_AFTER = (
+    datetime.fromisoformat(os.environ['JWT_REQUIRE_JTI_AFTER']) if os.environ.get('JWT_REQUIRE_JTI_AFTER') else None
+)
+
+security = HTTPBearer()
+
+
+def create_access_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + JWT_EXPIRATION_TIME
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return encoded_jwt
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Verified claims for a token, decoding it only on a cache miss"""
+    claims = claims_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if claims.get("user_id") is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        remaining = claims["exp"] - time.time()
+        claims_cache.set(token, claims, ttl_seconds=min(CLAIMS_CACHE_SECONDS, remaining))
+    elif claims["exp"] <= time.time():
+        claims_cache.pop(token)
+        raise HTTPException(status_code=401, detail="Token expired")
+
+    jti = claims.get("jti")
+    if jti is None:
+        if REQUIRE_JTI_AFTER and datetime.utcnow() >= REQUIRE_JTI_AFTER:
+            raise HTTPException(status_code=401, detail="Token expired")
+    elif jti in revoked_jtis:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return claims
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return decode_token(credentials.credentials)["user_id"]
+
+async def token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
+    return decode_token(credentials.credentials)
+
+async def load_current_user(db, user_id: str) -> Optional[Dict[str, Any]]:
+    """Current user's document without the password hash, cached between requests"""
+    user = profile_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, USER_PROJECTION)
+        if user is None:
+            return None
+        profile_cache.set(user_id, user)
+    return dict(user)
+
+def invalidate_current_user(user_id: str):
+    """Call after any write to the user's document"""
+    profile_cache.pop(user_id)
+
+async def revoke_token(db, claims: Dict[str, Any], token: Optional[str] = None):
+    """Kill a session even though its claims may still be cached"""
+    jti = claims.get("jti")
+    if not jti:
+        return
+    await db.revoked_tokens.update_one(
+        {"_id": jti},
+        {"$setOnInsert": {"user_id": claims["user_id"], "expires_at": datetime.utcfromtimestamp(claims["exp"])}},
+        upsert=True
+    )
+    revoked_jtis.add(jti)
+    if token:
+        claims_cache.pop(token)
+
+async def load_revocations(db):
+    """Refresh the in-memory revocation list (also picks up logouts from other processes).
+
+    The new set is built aside and swapped in with one assignment, so no request ever sees a
+    partly filled list; local revocations made while the query ran are carried over.
+    """
+    global revoked_jtis
+    known = set(revoked_jtis)
+    now = datetime.utcnow()
+    jtis = {revoked["_id"] async for revoked in db.revoked_tokens.find({"expires_at": {"$gt": now}}, {"_id": 1})}
+    revoked_jtis = jtis | (revoked_jtis - known)
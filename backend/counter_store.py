@@ -0,0 +1,111 @@
+# Counter Documents for HayvanPazarı
+#
+# Shared by message_counters and notification_counters: a counter field is $inc-ed once it
+# exists, seeded from the real count when it does not, and repaired from a recount in batches.
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from datetime import datetime
+
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+async def seed_counters(
+    collection,
+    field: str,
+    counts: Dict[str, int],
+    on_insert: Optional[Dict[str, Dict[str, Any]]] = None
+) -> bool:
+    """Set `field` from `counts` on counters where it does not exist yet.
+
+    Callers store the change being counted first, so the recount already includes it. Seeding
+    instead of $inc-ing from nothing keeps users from before counters existed from starting at 0.
+    Returns False when another write seeded some of them meanwhile; those values win.
+    """
+    if not counts:
+        return True
+    now = datetime.utcnow()
+    operations = []
+    for counter_id, count in counts.items():
+        update: Dict[str, Any] = {"$set": {field: count, "updated_at": now}}
+        if on_insert and counter_id in on_insert:
+            update["$setOnInsert"] = on_insert[counter_id]
+        operations.append(UpdateOne({"_id": counter_id, field: {"$exists": False}}, update, upsert=True))
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate _id on upsert: the counter exists, with the field set by a concurrent write
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+        return False
+    return True
+
+async def apply_or_seed(
+    collection,
+    counter_id: str,
+    field: str,
+    delta: int,
+    count: Callable[[], Awaitable[int]],
+    on_insert: Optional[Dict[str, Any]] = None
+) -> Optional[int]:
+    """$inc a counter that exists, or seed one that does not from `count()`.
+
+    Returns the new value, or None if a concurrent write seeded it first (reconciliation covers that overlap).
+    """
+    counter = await collection.find_one_and_update(
+        {"_id": counter_id, field: {"$exists": True}},
+        {"$inc": {field: delta}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={field: 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if counter is not None:
+        return counter[field]
+    value = await count()
+    seeded = await seed_counters(collection, field, {counter_id: value}, {counter_id: on_insert} if on_insert else None)
+    return value if seeded else None
+
+async def repair_counters(
+    collection,
+    field: str,
+    actual: Dict[str, int],
+    stored_query: Dict[str, Any],
+    on_insert: Optional[Dict[str, Dict[str, Any]]] = None
+) -> List[str]:
+    """Overwrite counters matching stored_query that differ from `actual`; ids missing from `actual` count 0.
+
+    Returns the ids that were rewritten.
+    """
+    stored = {
+        counter["_id"]: counter.get(field)
+        async for counter in collection.find(stored_query, {field: 1})
+    }
+    now = datetime.utcnow()
+    drifted = [counter_id for counter_id in actual.keys() | stored.keys() if stored.get(counter_id) != actual.get(counter_id, 0)]
+    if drifted:
+        operations = []
+        for counter_id in drifted:
+            update: Dict[str, Any] = {"$set": {field: actual.get(counter_id, 0), "updated_at": now}}
+            if on_insert and counter_id in on_insert:
+                update["$setOnInsert"] = on_insert[counter_id]
+            operations.append(UpdateOne({"_id": counter_id}, update, upsert=True))
+        await collection.bulk_write(operations, ordered=False)
+    return drifted
+
+async def reconcile_in_batches(
+    db,
+    repair_batch: Callable[[List[str]], Awaitable[None]],
+    batch_size: int = 200
+) -> int:
+    """Walk db.users by id in batches and hand each batch of user ids to repair_batch; returns users seen"""
+    users_seen = 0
+    last_id = None
+    while True:
+        query = {"id": {"$gt": last_id}} if last_id else {}
+        users = await db.users.find(query, {"id": 1}).sort("id", 1).limit(batch_size).to_list(batch_size)
+        if not users:
+            return users_seen
+        user_ids = [user["id"] for user in users]
+        last_id = user_ids[-1]
+        users_seen += len(user_ids)
+        await repair_batch(user_ids)
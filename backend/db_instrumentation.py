@@ -0,0 +1,197 @@
+# Mongo Command Instrumentation for HayvanPazarı
+#
+# A pymongo CommandListener attributes every command to the request that issued it.
+# Motor runs pymongo on executor threads but copies the caller's contextvars into them,
+# so the listener sees the request's QueryStats through query_stats_var.
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+import os
+import threading
+
+from pymongo import monitoring
+
+from metrics import metrics_registry, method_label, route_label
+
+logger = logging.getLogger(__name__)
+
+SLOW_COMMAND_MS = float(os.environ.get('MONGO_SLOW_COMMAND_MS', 100))
+# The same filter shape this many times in one request is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('MONGO_N_PLUS_ONE_THRESHOLD', 10))
+# Connection handshakes and heartbeats are not the application's queries
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+FILTER_FIELDS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+WRITE_FIELDS = {"update": ("updates", "q"), "delete": ("deletes", "q")}
+
+ShapeKey = Tuple[str, str, str]
+
+
+def filter_shape(value: Any, depth: int = 0) -> Any:
+    """Filter with values replaced by "?", so equal shapes mean the same query with other arguments"""
+    if depth > 4:
+        return "…"
+    if isinstance(value, dict):
+        return {key: filter_shape(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $in / $or with different lengths or a different clause order is still the same query
+        shapes = {repr(filter_shape(item, depth + 1)) for item in value if isinstance(item, dict)}
+        return sorted(shapes) if shapes else "?"
+    return "?"
+
+def command_filter(name: str, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if name in FILTER_FIELDS:
+        return command.get(FILTER_FIELDS[name])
+    if name in WRITE_FIELDS:
+        field, key = WRITE_FIELDS[name]
+        statements = command.get(field) or []
+        return statements[0].get(key) if statements else None
+    if name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        return pipeline[0].get("$match") if pipeline and "$match" in pipeline[0] else None
+    return None
+
+def shape_key(name: str, collection: str, command: Dict[str, Any]) -> ShapeKey:
+    query = command_filter(name, command)
+    shape = repr(filter_shape(query)) if query is not None else ""
+    return name, collection, shape
+
+
+class QueryStats:
+    """Commands issued on behalf of one request (or one assert_query_budget block)"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, key: ShapeKey, seconds: float):
+        # Listener callbacks arrive on motor's executor threads
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.shapes[key] += 1
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[ShapeKey, int]]:
+        return [(key, count) for key, count in self.shapes.most_common() if count >= threshold]
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {collection} {shape or '-'} ×{count}" for (name, collection, shape), count in self.shapes.most_common())
+
+
+query_stats_var: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command; started/succeeded are paired on (connection, request id)"""
+
+    def __init__(self, slow_ms: float = SLOW_COMMAND_MS):
+        self.slow_ms = slow_ms
+        self._pending: Dict[Tuple[Any, int], Tuple[Optional[QueryStats], ShapeKey]] = {}
+        self._lock = threading.Lock()
+        self.commands: Counter = Counter()
+        self.slow_count = 0
+        self.failed_count = 0
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        key = shape_key(event.command_name, collection if isinstance(collection, str) else "", event.command)
+        self._pending[(event.connection_id, event.request_id)] = (query_stats_var.get(), key)
+
+    def _finish(self, event) -> Optional[Tuple[ShapeKey, float]]:
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return None
+        stats, key = pending
+        seconds = event.duration_micros / 1_000_000
+        with self._lock:
+            self.commands[key[0]] += 1
+        if stats is not None:
+            stats.record(key, seconds)
+        if seconds * 1000 >= self.slow_ms:
+            with self._lock:
+                self.slow_count += 1
+            name, collection, shape = key
+            logger.warning(
+                "Slow Mongo command",
+                extra={"command": name, "collection": collection, "shape": shape, "ms": round(seconds * 1000, 1)}
+            )
+        return key, seconds
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        if self._finish(event) is not None:
+            with self._lock:
+                self.failed_count += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            values = {f'commands_total{{command="{name}"}}': count for name, count in self.commands.items()}
+            values["slow_commands_total"] = self.slow_count
+            values["failed_commands_total"] = self.failed_count
+        return values
+
+
+command_listener = MongoCommandListener()
+
+# Completed request stats are handed to these while an assert_query_budget block is open
+_budget_watchers: List[List[Tuple[str, QueryStats]]] = []
+
+
+class QueryStatsMiddleware:
+    """Pure ASGI: gives each request its own QueryStats, then reports count and N+1 suspects per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = query_stats_var.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            query_stats_var.reset(token)
+            route = route_label(scope)
+            metrics_registry.route(method_label(scope["method"]), route).record_queries(stats.count, stats.seconds)
+            for (name, collection, shape), count in stats.repeated():
+                logger.warning(
+                    "Possible N+1 query",
+                    extra={"route": route, "command": name, "collection": collection, "shape": shape, "count": count}
+                )
+            for watcher in _budget_watchers:
+                watcher.append((f"{scope['method']} {route}", stats))
+
+
+@contextmanager
+def assert_query_budget(max_queries: int):
+    """Fail if any request made inside the block, or the block's own awaited code, issues more than max_queries commands.
+
+        with assert_query_budget(4):
+            client.get("/api/messages/conversations", headers=auth)
+    """
+    watcher: List[Tuple[str, QueryStats]] = []
+    own = QueryStats()
+    token = query_stats_var.set(own)
+    _budget_watchers.append(watcher)
+    try:
+        yield watcher
+    finally:
+        _budget_watchers.remove(watcher)
+        query_stats_var.reset(token)
+
+    if own.count:
+        watcher.append(("block", own))
+    over = [(label, stats) for label, stats in watcher if stats.count > max_queries]
+    if over:
+        details = "; ".join(f"{label}: {stats.count} queries ({stats.summary()})" for label, stats in over)
+        raise AssertionError(f"Query budget of {max_queries} exceeded: {details}")
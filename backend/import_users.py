@@ -0,0 +1,237 @@
+# Bulk User Import for HayvanPazarı
+#
+#   python import_users.py farmers.csv
+#   python import_users.py farmers.ndjson --batch-size 1000 --errors errors.ndjson
+#
+# CSV needs a header row. Both formats use the /auth/register fields
+# (email, phone, password, first_name, last_name) plus optional user_type, city and district.
+#
+# Progress goes through the structured logger like the server's output; the row errors and the
+# final summary printed at the end are the command's result, so they stay plain stdout.
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pathlib import Path
+from pydantic import BaseModel, EmailStr, ValidationError
+from pymongo.errors import BulkWriteError
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from datetime import datetime
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+
+from logging_setup import setup_logging, stop_logging
+from password_hashing import hash_password_sync
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+USER_TYPES = ("buyer", "seller", "both")
+DEFAULT_BATCH_SIZE = 500
+
+
+class ImportedUser(BaseModel):
+    email: EmailStr
+    phone: str
+    password: str
+    first_name: str
+    last_name: str
+    user_type: str = "buyer"
+    city: Optional[str] = None
+    district: Optional[str] = None
+
+
+def read_rows(path: Path) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line number, raw row) pairs; a malformed row or line comes back as {"_error": ...}"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.suffix.lower() == ".csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                # DictReader puts values past the header under the key None
+                if None in row:
+                    yield reader.line_num, {"_error": "too many columns"}
+                    continue
+                yield reader.line_num, {key: value for key, value in row.items() if value not in (None, "")}
+            return
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, {"_error": f"invalid JSON: {e.msg}"}
+                continue
+            yield line_no, row if isinstance(row, dict) else {"_error": "expected a JSON object"}
+
+def user_document(user: ImportedUser, hashed_password: str, now: datetime) -> Dict[str, Any]:
+    """Same shape /auth/register writes"""
+    doc = {
+        "email": user.email,
+        "phone": user.phone,
+        "password": hashed_password,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "id": str(uuid.uuid4()),
+        "user_type": user.user_type,
+        "is_verified": False,
+        "is_phone_verified": False,
+        "kyc_status": "not_verified",
+        "rating": 0.0,
+        "total_reviews": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+    if user.city or user.district:
+        doc["location"] = {"city": user.city or "", "district": user.district or ""}
+    return doc
+
+
+class UserImporter:
+    """Validates in-process, checks uniqueness once per batch, hashes on every core, writes unordered"""
+
+    def __init__(self, db, pool: ProcessPoolExecutor, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False):
+        self.db = db
+        self.pool = pool
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.seen_emails = set()
+        self.seen_phones = set()
+        self.rows = 0
+        self.imported = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def error(self, line_no: int, message: str, email: Optional[str] = None):
+        self.errors.append({"line": line_no, "email": email, "error": message})
+
+    def validate(self, line_no: int, row: Dict[str, Any]) -> Optional[ImportedUser]:
+        if "_error" in row:
+            self.error(line_no, row["_error"])
+            return None
+        try:
+            user = ImportedUser(**row)
+        except ValidationError as e:
+            fields = ", ".join(".".join(str(part) for part in err["loc"]) for err in e.errors())
+            self.error(line_no, f"invalid fields: {fields}", row.get("email"))
+            return None
+        if user.user_type not in USER_TYPES:
+            self.error(line_no, f"invalid user_type: {user.user_type}", user.email)
+            return None
+        if user.email in self.seen_emails or user.phone in self.seen_phones:
+            self.error(line_no, "duplicate email or phone in file", user.email)
+            return None
+        self.seen_emails.add(user.email)
+        self.seen_phones.add(user.phone)
+        return user
+
+    async def import_batch(self, batch: List[Tuple[int, ImportedUser]]):
+        # One query for the whole batch instead of a find_one per row
+        emails = [user.email for _, user in batch]
+        phones = [user.phone for _, user in batch]
+        taken_emails, taken_phones = set(), set()
+        async for existing in self.db.users.find(
+            {"$or": [{"email": {"$in": emails}}, {"phone": {"$in": phones}}]},
+            {"_id": 0, "email": 1, "phone": 1}
+        ):
+            taken_emails.add(existing.get("email"))
+            taken_phones.add(existing.get("phone"))
+
+        fresh = []
+        for line_no, user in batch:
+            if user.email in taken_emails or user.phone in taken_phones:
+                self.error(line_no, "user already exists", user.email)
+            else:
+                fresh.append((line_no, user))
+        if not fresh:
+            return
+
+        loop = asyncio.get_running_loop()
+        hashes = await asyncio.gather(*(
+            loop.run_in_executor(self.pool, hash_password_sync, user.password) for _, user in fresh
+        ))
+        now = datetime.utcnow()
+        docs = [user_document(user, hashed, now) for (_, user), hashed in zip(fresh, hashes)]
+        if self.dry_run:
+            self.imported += len(docs)
+            return
+
+        try:
+            await self.db.users.insert_many(docs, ordered=False)
+            self.imported += len(docs)
+        except BulkWriteError as e:
+            # Unordered: everything except the reported rows was written
+            failed = e.details["writeErrors"]
+            for write_error in failed:
+                line_no, user = fresh[write_error["index"]]
+                message = "user already exists" if write_error["code"] == 11000 else write_error["errmsg"]
+                self.error(line_no, message, user.email)
+            self.imported += len(docs) - len(failed)
+
+    async def run(self, path: Path):
+        batch: List[Tuple[int, ImportedUser]] = []
+        for line_no, row in read_rows(path):
+            self.rows += 1
+            user = self.validate(line_no, row)
+            if user is None:
+                continue
+            batch.append((line_no, user))
+            if len(batch) >= self.batch_size:
+                await self.import_batch(batch)
+                batch = []
+                logger.info(
+                    "Import progress",
+                    extra={"rows": self.rows, "imported": self.imported, "errors": len(self.errors)}
+                )
+        if batch:
+            await self.import_batch(batch)
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            importer = UserImporter(db, pool, batch_size=args.batch_size, dry_run=args.dry_run)
+            await importer.run(Path(args.path))
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - started
+
+    for err in importer.errors[:args.show_errors]:
+        print(f"❌ line {err['line']} ({err['email'] or '-'}): {err['error']}")
+    if len(importer.errors) > args.show_errors:
+        print(f"   ... {len(importer.errors) - args.show_errors} more errors")
+    if args.errors:
+        with open(args.errors, "w", encoding="utf-8") as f:
+            for err in importer.errors:
+                f.write(json.dumps(err, ensure_ascii=False) + "\n")
+
+    action = "validated" if args.dry_run else "imported"
+    print(
+        f"✅ {importer.imported}/{importer.rows} users {action}, {len(importer.errors)} errors "
+        f"in {elapsed:.1f}s ({importer.rows / elapsed if elapsed else 0:.0f} rows/sec)"
+    )
+    return 1 if importer.errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import users from a CSV or NDJSON file")
+    parser.add_argument("path", help="users.csv or users.ndjson")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="password hashing processes")
+    parser.add_argument("--errors", help="write every row error to this NDJSON file")
+    parser.add_argument("--show-errors", type=int, default=20, help="row errors to print")
+    parser.add_argument("--dry-run", action="store_true", help="validate and hash without writing")
+    setup_logging()
+    try:
+        exit_code = asyncio.run(main(parser.parse_args()))
+    finally:
+        stop_logging()
+    raise SystemExit(exit_code)
@@ -0,0 +1,97 @@
+# Background Job Queue for HayvanPazarı
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def idempotent(job: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Mark a job as safe to run again after a failure; unmarked jobs are never retried"""
+    job.idempotent = True
+    return job
+
+
+class JobQueue:
+    """In-process asyncio work queue with a bounded buffer, worker pool and retries for idempotent jobs"""
+
+    def __init__(self, name: str, maxsize: int = 1000, workers: int = 4, max_retries: int = 3, retry_delay: float = 0.5):
+        self.name = name
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._closing = False
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def start(self):
+        """Create the queue on the running loop and spawn workers"""
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._closing = False
+        self._workers = [
+            asyncio.create_task(self._worker(index)) for index in range(self.worker_count)
+        ]
+        logger.info("Job queue started", extra={"queue": self.name, "workers": self.worker_count})
+
+    async def submit(self, job: Callable[..., Awaitable[Any]], *args, **kwargs):
+        """Queue a coroutine function call; waits for a free slot when the queue is full"""
+        if self._queue is None or self._closing:
+            # Not running (startup/shutdown edge or scripts): do the work inline
+            await job(*args, **kwargs)
+            return
+        await self._queue.put((job, args, kwargs))
+
+    async def _worker(self, index: int):
+        while True:
+            job, args, kwargs = await self._queue.get()
+            try:
+                await self._run_with_retries(job, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    async def _run_with_retries(self, job, args, kwargs):
+        # A job that fails after its first write (insert done, counter or publish failed) would
+        # repeat that write on retry, so only jobs marked @idempotent get more than one attempt
+        max_retries = self.max_retries if getattr(job, "idempotent", False) else 0
+        for attempt in range(max_retries + 1):
+            try:
+                await job(*args, **kwargs)
+                self.processed += 1
+                return
+            except Exception:
+                if attempt == max_retries:
+                    self.failed += 1
+                    logger.exception("Job failed", extra={"queue": self.name, "job": job.__name__, "attempts": attempt + 1})
+                    return
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay * (2 ** attempt))
+
+    async def drain(self, timeout: float = 10.0):
+        """Stop accepting jobs, wait for queued work to finish, then stop workers"""
+        if self._queue is None:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Job queue drain timed out", extra={"queue": self.name, "remaining": self._queue.qsize()})
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Job queue drained", extra={"queue": self.name})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "maxsize": self.maxsize,
+            "workers": len(self._workers),
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried
+        }
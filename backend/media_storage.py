@@ -0,0 +1,177 @@
+# Media Storage for HayvanPazarı
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, UploadFile
+from pathlib import Path
+from typing import Dict, Optional
+import asyncio
+import json
+import os
+import uuid
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', Path(__file__).parent / 'uploads'))
+# Never mounted: KYC documents and in-progress uploads
+PRIVATE_UPLOAD_DIR = Path(os.environ.get('PRIVATE_UPLOAD_DIR', Path(__file__).parent / 'private_uploads'))
+# Files are served by a StaticFiles mount under this prefix; documents only store the URL
+MEDIA_URL_PREFIX = "/api/media"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+MAX_PROFILE_IMAGE_BYTES = int(os.environ.get('MAX_PROFILE_IMAGE_BYTES', 10 * 1024 * 1024))
+# Multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+PROFILE_IMAGE_SIZE = 512
+PROFILE_IMAGE_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+# Refuse decompression bombs before allocating pixels
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+# Decoding and resizing are CPU bound; keep them off the event loop and bounded
+image_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_WORKERS', 2)), thread_name_prefix="images")
+
+
+class InvalidImage(Exception):
+    """Upload is not an image we accept"""
+
+class BodyTooLarge(Exception):
+    """Request body passed the route's limit while it was being received"""
+
+
+def media_path(url: str) -> Optional[Path]:
+    """Local file behind a media URL, or None for anything else (e.g. legacy base64 values)"""
+    if not url or not url.startswith(MEDIA_URL_PREFIX + "/"):
+        return None
+    path = (UPLOAD_DIR / url[len(MEDIA_URL_PREFIX) + 1:]).resolve()
+    if UPLOAD_DIR.resolve() not in path.parents:
+        return None
+    return path
+
+def media_url(path: Path) -> str:
+    return f"{MEDIA_URL_PREFIX}/{path.relative_to(UPLOAD_DIR).as_posix()}"
+
+def delete_media(url: Optional[str]):
+    path = media_path(url)
+    if path is not None:
+        path.unlink(missing_ok=True)
+
+class BodySizeLimitMiddleware:
+    """Pure ASGI: cap request bodies per path before any handler or form parser sees them.
+
+    FastAPI parses (and Starlette spools) multipart bodies before the endpoint or its
+    dependencies run, so the limit has to sit here: a too-large Content-Length is refused
+    at once, and a chunked or lying body is cut off as soon as it passes the limit.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+                await self._reject(send, max_bytes)
+                return
+
+        received = 0
+        too_large = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    too_large = True
+                    raise BodyTooLarge()
+            return message
+
+        async def limited_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                if started:
+                    return
+                started = True
+                if too_large:
+                    # The parser's own error response (FastAPI turns it into a 400) becomes the 413
+                    await self._reject(send, max_bytes)
+                    return
+            elif too_large:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except BodyTooLarge:
+            if not started:
+                await self._reject(send, max_bytes)
+
+    async def _reject(self, send, max_bytes: int):
+        body = json.dumps({"detail": f"Dosya en fazla {max_bytes // (1024 * 1024)} MB olabilir"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+async def save_upload(upload: UploadFile, dest: Path, max_bytes: int) -> int:
+    """Copy an upload to disk chunk by chunk, aborting with 413 past max_bytes.
+
+    This only bounds the copy: the request body has already been received and spooled by
+    the multipart parser, which BodySizeLimitMiddleware must cap for the route.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    written = 0
+    try:
+        with open(dest, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Dosya en fazla {max_bytes // (1024 * 1024)} MB olabilir")
+                await loop.run_in_executor(None, out.write, chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return written
+
+def process_profile_image_sync(src: Path, dest: Path):
+    """Validate, apply EXIF rotation, downscale and re-encode as JPEG (drops metadata)"""
+    try:
+        with Image.open(src) as image:
+            if image.format not in PROFILE_IMAGE_FORMATS:
+                raise InvalidImage(f"unsupported format {image.format}")
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((PROFILE_IMAGE_SIZE, PROFILE_IMAGE_SIZE))
+            image.convert("RGB").save(dest, "JPEG", quality=85, optimize=True)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidImage(str(e))
+
+async def store_profile_image(upload: UploadFile, user_id: str) -> str:
+    """Stream the upload to disk, downscale it and return the URL to store on the user.
+
+    The body limit for the route is enforced by BodySizeLimitMiddleware while it is received;
+    a body within that limit is still spooled to a temporary file by Starlette before we copy it.
+    """
+    name = uuid.uuid4().hex
+    raw = PRIVATE_UPLOAD_DIR / "tmp" / f"{name}.upload"
+    dest = UPLOAD_DIR / "profile" / user_id / f"{name}.jpg"
+    await save_upload(upload, raw, MAX_PROFILE_IMAGE_BYTES)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        await asyncio.get_running_loop().run_in_executor(image_executor, process_profile_image_sync, raw, dest)
+    except InvalidImage:
+        dest.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Geçersiz resim dosyası")
+    finally:
+        raw.unlink(missing_ok=True)
+    return media_url(dest)
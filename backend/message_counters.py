@@ -0,0 +1,95 @@
+# Unread Message Counters for HayvanPazarı
+from typing import Dict, Any, List
+import logging
+
+from counter_store import apply_or_seed, reconcile_in_batches, repair_counters
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_counter_id(user_id: str, peer_id: str, listing_id: str) -> str:
+    """Counter key for one user's view of a (peer, listing) conversation"""
+    return f"{user_id}:{peer_id}:{listing_id}"
+
+async def _update_counters(db, user_id: str, peer_id: str, listing_id: str, delta: int):
+    # Counters that do not exist yet are seeded from the real unread count (which includes this change)
+    await apply_or_seed(
+        db.conversation_counters,
+        conversation_counter_id(user_id, peer_id, listing_id),
+        "unread",
+        delta,
+        lambda: db.messages.count_documents({
+            "receiver_id": user_id, "sender_id": peer_id, "listing_id": listing_id, "is_read": {"$ne": True}
+        }),
+        on_insert={"user_id": user_id, "peer_id": peer_id, "listing_id": listing_id}
+    )
+    await apply_or_seed(
+        db.user_counters,
+        user_id,
+        "unread_messages",
+        delta,
+        lambda: db.messages.count_documents({"receiver_id": user_id, "is_read": {"$ne": True}})
+    )
+
+async def increment_unread(db, receiver_id: str, sender_id: str, listing_id: str):
+    """Bump the receiver's unread counters after a message is stored"""
+    await _update_counters(db, receiver_id, sender_id, listing_id, 1)
+
+async def decrement_unread(db, user_id: str, peer_id: str, listing_id: str, count: int):
+    """Take `count` messages that were just marked read off the user's counters"""
+    if count <= 0:
+        return
+    await _update_counters(db, user_id, peer_id, listing_id, -count)
+
+async def get_unread_total(db, user_id: str) -> int:
+    """Total unread messages for the badge, read from a single counter document"""
+    counters = await db.user_counters.find_one({"_id": user_id}, {"unread_messages": 1})
+    if not counters or "unread_messages" not in counters:
+        # Not seeded yet: the next increment or read seeds it, until then count directly
+        return await db.messages.count_documents({"receiver_id": user_id, "is_read": {"$ne": True}})
+    return max(counters["unread_messages"], 0)
+
+async def get_unread_by_peer(db, user_id: str) -> Dict[str, int]:
+    """Unread messages per conversation partner (summed over listings)"""
+    by_peer: Dict[str, int] = {}
+    cursor = db.conversation_counters.find(
+        {"user_id": user_id, "unread": {"$gt": 0}},
+        {"peer_id": 1, "unread": 1}
+    )
+    async for counter in cursor:
+        by_peer[counter["peer_id"]] = by_peer.get(counter["peer_id"], 0) + counter["unread"]
+    return by_peer
+
+async def reconcile_unread_counters(db, batch_size: int = 200) -> Dict[str, int]:
+    """Recount unread messages from db.messages and repair drifted counters in batches of users"""
+    stats = {"users": 0, "conversations_fixed": 0, "users_fixed": 0}
+
+    async def repair_batch(user_ids: List[str]):
+        # Actual unread counts per (receiver, sender, listing)
+        pipeline = [
+            {"$match": {"receiver_id": {"$in": user_ids}, "is_read": {"$ne": True}}},
+            {
+                "$group": {
+                    "_id": {"user_id": "$receiver_id", "peer_id": "$sender_id", "listing_id": "$listing_id"},
+                    "unread": {"$sum": 1}
+                }
+            }
+        ]
+        actual: Dict[str, int] = {}
+        keys: Dict[str, Dict[str, Any]] = {}
+        totals = {user_id: 0 for user_id in user_ids}
+        async for row in db.messages.aggregate(pipeline):
+            key = row["_id"]
+            counter_id = conversation_counter_id(key["user_id"], key["peer_id"], key["listing_id"])
+            actual[counter_id] = row["unread"]
+            keys[counter_id] = key
+            totals[key["user_id"]] += row["unread"]
+
+        fixed = await repair_counters(db.conversation_counters, "unread", actual, {"user_id": {"$in": user_ids}}, keys)
+        stats["conversations_fixed"] += len(fixed)
+        fixed = await repair_counters(db.user_counters, "unread_messages", totals, {"_id": {"$in": user_ids}})
+        stats["users_fixed"] += len(fixed)
+
+    stats["users"] = await reconcile_in_batches(db, repair_batch, batch_size)
+    logger.info("Reconciled unread message counters", extra=stats)
+    return stats
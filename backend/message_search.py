@@ -0,0 +1,161 @@
+# Message Search for HayvanPazarı
+from typing import Dict, Any, List
+from datetime import datetime
+from bson import ObjectId
+import logging
+import re
+
+from pymongo.errors import BulkWriteError
+
+from user_cache import user_summaries
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+# Fold Turkish letters to ASCII so "Şimşek", "simsek" and "SİMŞEK" all match
+TURKISH_FOLD = str.maketrans({
+    "ç": "c", "Ç": "c",
+    "ğ": "g", "Ğ": "g",
+    "ı": "i", "I": "i", "İ": "i",
+    "ö": "o", "Ö": "o",
+    "ş": "s", "Ş": "s",
+    "ü": "u", "Ü": "u",
+    "â": "a", "Â": "a",
+    "î": "i", "Î": "i",
+    "û": "u", "Û": "u"
+})
+# "30.000" / "30,000" -> "30000" so amounts are single tokens
+THOUSANDS_SEPARATOR = re.compile(r"(?<=\d)[.,](?=\d{3}\b)")
+# Backfill progress document in db.maintenance
+BACKFILL_STATE_ID = "message_search_backfill"
+
+
+def fold_turkish(text: str) -> str:
+    return THOUSANDS_SEPARATOR.sub("", text.translate(TURKISH_FOLD)).lower()
+
+def search_documents(message_dict: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One search entry per participant, so each user's index range only holds their own threads"""
+    text = message_dict.get("message", "")
+    if message_dict.get("offer_amount"):
+        text = f"{text} {message_dict['offer_amount']:.0f}"
+    folded = fold_turkish(text)
+
+    documents = []
+    for owner_id, peer_id in (
+        (message_dict["sender_id"], message_dict["receiver_id"]),
+        (message_dict["receiver_id"], message_dict["sender_id"])
+    ):
+        documents.append({
+            "_id": f"{message_dict['id']}:{owner_id}",
+            "owner_id": owner_id,
+            "peer_id": peer_id,
+            "listing_id": message_dict["listing_id"],
+            "message_id": message_dict["id"],
+            "text": folded,
+            "created_at": message_dict.get("created_at", datetime.utcnow())
+        })
+    return documents
+
+async def index_message(db, message_dict: Dict[str, Any]):
+    await db.message_search.insert_many(search_documents(message_dict), ordered=False)
+
+async def remove_from_search(db, message_ids: List[str]):
+    """Drop both participants' entries for messages that were deleted"""
+    if message_ids:
+        await db.message_search.delete_many({"message_id": {"$in": message_ids}})
+
+async def backfill_message_search(db, batch_size: int = 1000) -> int:
+    """Index messages sent before search existed.
+
+    Progress is checkpointed in db.maintenance after every batch, so a restart resumes where
+    the last run stopped instead of re-indexing from the first message.
+    """
+    state = await db.maintenance.find_one({"_id": BACKFILL_STATE_ID}) or {}
+    if state.get("done"):
+        return 0
+    indexed = 0
+    last_id = state.get("last_id")
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        messages = await db.messages.find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not messages:
+            break
+        last_id = messages[-1]["_id"]
+        documents = [doc for message in messages if message.get("id") for doc in search_documents(message)]
+        if documents:
+            try:
+                await db.message_search.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                # Duplicates from a partial earlier run (or live indexing) are fine; anything else
+                # stops the backfill before the checkpoint moves past this batch
+                if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                    raise
+        indexed += len(messages)
+        await db.maintenance.update_one(
+            {"_id": BACKFILL_STATE_ID},
+            {"$set": {"last_id": last_id, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    await db.maintenance.update_one(
+        {"_id": BACKFILL_STATE_ID},
+        {"$set": {"done": True, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    logger.info("Backfilled message search", extra={"indexed": indexed})
+    return indexed
+
+async def search_messages(db, user_id: str, query: str, limit: int = 20, skip: int = 0) -> Dict[str, Any]:
+    """Search the caller's own conversations, newest best matches first"""
+    hits = await db.message_search.find(
+        {"owner_id": user_id, "$text": {"$search": fold_turkish(query)}},
+        {"message_id": 1, "peer_id": 1, "listing_id": 1, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"}), ("created_at", -1)]).skip(skip).limit(limit + 1).to_list(limit + 1)
+
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    if not hits:
+        return {"results": [], "has_more": False}
+
+    messages = {
+        message["id"]: message
+        async for message in db.messages.find({"id": {"$in": [hit["message_id"] for hit in hits]}}, {"_id": 0})
+    }
+    peers = await user_summaries.get_many(db, [hit["peer_id"] for hit in hits])
+
+    listing_ids = list({hit["listing_id"] for hit in hits})
+    object_ids = [ObjectId(listing_id) for listing_id in listing_ids if ObjectId.is_valid(listing_id)]
+    listings = {}
+    async for listing in db.listings.find(
+        {"$or": [{"id": {"$in": listing_ids}}, {"_id": {"$in": listing_ids + object_ids}}]},
+        {"id": 1, "title": 1, "price": 1, "images": {"$slice": 1}}
+    ):
+        summary = {
+            "id": str(listing["_id"]),
+            "title": listing.get("title"),
+            "price": listing.get("price"),
+            "images": listing.get("images", [])
+        }
+        listings[str(listing["_id"])] = summary
+        if listing.get("id"):
+            listings[listing["id"]] = summary
+
+    results = []
+    for hit in hits:
+        message = messages.get(hit["message_id"])
+        if not message:
+            continue
+        peer = peers.get(hit["peer_id"])
+        results.append({
+            "message": message,
+            "other_user": {
+                "id": peer["id"],
+                "first_name": peer["first_name"],
+                "last_name": peer["last_name"],
+                "profile_image": peer["profile_image"]
+            } if peer else None,
+            "listing": listings.get(hit["listing_id"]),
+            "score": hit["score"]
+        })
+
+    return {"results": results, "has_more": has_more}
@@ -0,0 +1,231 @@
+# Metrics for HayvanPazarı (Prometheus text format)
+from bisect import bisect_left
+from typing import Dict, Callable, List, Optional, Tuple
+import asyncio
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+LOOP_LAG_INTERVAL = 0.5
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-on-render histogram; observe() is a bisect and two additions"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str, lines: List[str]):
+        sep = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{_format_value(bound)}"}} {cumulative}')
+        braces = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{braces} {self.sum}")
+        lines.append(f"{name}_count{braces} {self.count}")
+
+
+class RouteMetrics:
+    """Pre-bound series for one method + route template; labels are rendered once, at creation"""
+
+    __slots__ = ("labels", "latency", "statuses", "queries", "query_seconds")
+
+    def __init__(self, method: str, route: str):
+        self.labels = f'method="{method}",route="{route}"'
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statuses: Dict[int, int] = {}
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_seconds = 0.0
+
+    def record(self, status: int, seconds: float):
+        self.latency.observe(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def record_queries(self, count: int, seconds: float):
+        self.queries.observe(count)
+        self.query_seconds += seconds
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self.in_flight = 0
+        self.streams_open = 0
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.loop_lag_last = 0.0
+        # name → (callable returning {metric suffix: value}, {suffix: (type, help)}); read only on scrape
+        self.collectors: Dict[str, Tuple[Callable[[], Dict[str, float]], Dict[str, Tuple[str, str]]]] = {}
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def route(self, method: str, route: str) -> RouteMetrics:
+        key = (method, route)
+        metrics = self.routes.get(key)
+        if metrics is None:
+            metrics = self.routes[key] = RouteMetrics(method, route)
+        return metrics
+
+    def add_collector(self, name: str, collect: Callable[[], Dict[str, float]], metrics: Dict[str, Tuple[str, str]]):
+        """Register values read on scrape; `metrics` declares each suffix as (counter|gauge, help).
+
+        Keys returned by `collect` may carry labels ('sent_total{channel="push"}'); undeclared
+        suffixes are not exported, so nothing reaches the scraper untyped.
+        """
+        for suffix, (kind, _) in metrics.items():
+            if kind not in ("counter", "gauge") or (kind == "counter") != suffix.endswith("_total"):
+                raise ValueError(f"{name}_{suffix}: counters end in _total, gauges do not")
+        self.collectors[name] = (collect, metrics)
+
+    async def start(self):
+        self._lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    async def _measure_loop_lag(self):
+        """How late a sleep wakes up is how long something else held the loop"""
+        while True:
+            expected = time.perf_counter() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(time.perf_counter() - expected, 0.0)
+            self.loop_lag_last = lag
+            self.loop_lag.observe(lag)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        lines.append("# HELP http_requests_total Requests by route template, method and status")
+        lines.append("# TYPE http_requests_total counter")
+        for metrics in list(self.routes.values()):
+            for status, count in list(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{{metrics.labels},status="{status}"}} {count}')
+        lines.append("# HELP http_request_duration_seconds Request latency by route template and method (streams: until headers)")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for metrics in list(self.routes.values()):
+            metrics.latency.render("http_request_duration_seconds", metrics.labels, lines)
+
+        lines.append("# HELP http_request_db_queries Mongo commands per request by route template and method")
+        lines.append("# TYPE http_request_db_queries histogram")
+        for metrics in list(self.routes.values()):
+            if metrics.queries.count:
+                metrics.queries.render("http_request_db_queries", metrics.labels, lines)
+        lines.append("# HELP http_request_db_seconds_total Time spent in Mongo commands by route template and method")
+        lines.append("# TYPE http_request_db_seconds_total counter")
+        for metrics in list(self.routes.values()):
+            if metrics.queries.count:
+                lines.append(f"http_request_db_seconds_total{{{metrics.labels}}} {metrics.query_seconds}")
+
+        lines.append("# HELP http_requests_in_flight Requests being served")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append(f"http_requests_in_flight {self.in_flight}")
+        lines.append("# HELP http_streams_open Streaming responses (SSE) currently open")
+        lines.append("# TYPE http_streams_open gauge")
+        lines.append(f"http_streams_open {self.streams_open}")
+        lines.append("# HELP event_loop_lag_seconds Event loop lag at the last measurement")
+        lines.append("# TYPE event_loop_lag_seconds gauge")
+        lines.append(f"event_loop_lag_seconds {self.loop_lag_last}")
+        lines.append("# HELP event_loop_lag_histogram_seconds Event loop lag measurements")
+        lines.append("# TYPE event_loop_lag_histogram_seconds histogram")
+        self.loop_lag.render("event_loop_lag_histogram_seconds", "", lines)
+
+        for name, (collect, declared) in list(self.collectors.items()):
+            try:
+                values = collect()
+            except Exception:
+                continue
+            samples: Dict[str, List[str]] = {}
+            for key, value in values.items():
+                if value is not None:
+                    samples.setdefault(key.split("{", 1)[0], []).append(f"{name}_{key} {value}")
+            for suffix, (kind, help_text) in declared.items():
+                if suffix in samples:
+                    lines.append(f"# HELP {name}_{suffix} {help_text}")
+                    lines.append(f"# TYPE {name}_{suffix} {kind}")
+                    lines.extend(samples[suffix])
+        return "\n".join(lines) + "\n"
+
+
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+
+def method_label(method: str) -> str:
+    # Clients choose the method; don't let them choose our label values
+    return method if method in HTTP_METHODS else "OTHER"
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path_format
+    if "endpoint" in scope:
+        # Mounted apps (static media): one series for the whole mount
+        return scope.get("root_path", "") + "/{path}"
+    # 404s: unmatched paths must not become series of their own
+    return "unmatched"
+
+
+STREAMING_CONTENT_TYPES = (b"text/event-stream",)
+
+
+class MetricsMiddleware:
+    """Pure ASGI (no BaseHTTPMiddleware task/stream overhead).
+
+    The route template is read from scope["route"], which FastAPI's router fills in on the
+    shared scope, so /api/listings/{listing_id} is one series however many ids are requested.
+    Streaming responses (SSE) stay open for minutes: once their headers go out they move from
+    in_flight to streams_open, and their latency is the time to those headers.
+    """
+
+    def __init__(self, app, registry: "MetricsRegistry"):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        status = 500
+        streaming = False
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                if content_type.startswith(STREAMING_CONTENT_TYPES):
+                    streaming = True
+                    registry.in_flight -= 1
+                    registry.streams_open += 1
+                    registry.route(method_label(scope["method"]), route_label(scope)).record(status, time.perf_counter() - started)
+            await send(message)
+
+        registry.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if streaming:
+                registry.streams_open -= 1
+            else:
+                registry.in_flight -= 1
+                registry.route(method_label(scope["method"]), route_label(scope)).record(status, time.perf_counter() - started)
+
+
+metrics_registry = MetricsRegistry()
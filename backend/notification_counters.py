@@ -0,0 +1,127 @@
+# Unread Notification Counters for HayvanPazarı
+from typing import Dict, Iterable, List
+from datetime import datetime
+from collections import Counter
+import logging
+
+from pymongo import UpdateOne
+
+from counter_store import apply_or_seed, reconcile_in_batches, repair_counters, seed_counters
+from notification_stream import notification_streams
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Counters live next to unread_messages in db.user_counters
+COUNTER_FIELD = "unread_notifications"
+
+# Polls hit this on every refresh; writes keep it current so the TTL only bounds drift
+unread_cache = TTLCache(maxsize=20000, ttl_seconds=300)
+
+
+async def _count_unread(db, user_ids: List[str]) -> Dict[str, int]:
+    counts = {user_id: 0 for user_id in user_ids}
+    async for row in db.notifications.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}, "status": "unread"}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]):
+        counts[row["_id"]] = row["unread"]
+    return counts
+
+async def _seed_counters(db, user_ids: List[str]) -> Dict[str, int]:
+    """Seed missing counters from the real unread count (see counter_store.seed_counters)"""
+    counts = await _count_unread(db, user_ids)
+    if await seed_counters(db.user_counters, COUNTER_FIELD, counts):
+        for user_id, count in counts.items():
+            unread_cache.set(user_id, count)
+    else:
+        for user_id in user_ids:
+            unread_cache.pop(user_id)
+    return counts
+
+async def adjust_unread_notifications(db, user_id: str, delta: int) -> int:
+    """Apply +/- delta to the user's unread notification counter and return the new value"""
+    if delta == 0:
+        return await get_unread_notification_count(db, user_id)
+
+    async def recount() -> int:
+        return (await _count_unread(db, [user_id]))[user_id]
+
+    count = await apply_or_seed(db.user_counters, user_id, COUNTER_FIELD, delta, recount)
+    if count is None:
+        # Seeded concurrently by another write; read what won
+        unread_cache.pop(user_id)
+        count = await get_unread_notification_count(db, user_id)
+    else:
+        count = max(count, 0)
+        unread_cache.set(user_id, count)
+    notification_streams.publish_unread_count(user_id, count)
+    return count
+
+async def increment_unread_notifications_bulk(db, user_ids: Iterable[str]):
+    """One bulk_write for a fan-out; cached values are dropped rather than guessed"""
+    increments = Counter(user_ids)
+    if not increments:
+        return
+    seeded = {
+        counters["_id"]
+        async for counters in db.user_counters.find(
+            {"_id": {"$in": list(increments)}, COUNTER_FIELD: {"$exists": True}},
+            {"_id": 1}
+        )
+    }
+    now = datetime.utcnow()
+    if seeded:
+        await db.user_counters.bulk_write([
+            UpdateOne(
+                {"_id": user_id, COUNTER_FIELD: {"$exists": True}},
+                {"$inc": {COUNTER_FIELD: increments[user_id]}, "$set": {"updated_at": now}}
+            )
+            for user_id in seeded
+        ], ordered=False)
+        for user_id in seeded:
+            unread_cache.pop(user_id)
+    unseeded = [user_id for user_id in increments if user_id not in seeded]
+    if unseeded:
+        await _seed_counters(db, unseeded)
+    for user_id in increments:
+        if notification_streams.has_listeners(user_id):
+            notification_streams.publish_unread_count(user_id, await get_unread_notification_count(db, user_id))
+
+async def reset_unread_notifications(db, user_id: str, count: int = 0):
+    await db.user_counters.update_one(
+        {"_id": user_id},
+        {"$set": {COUNTER_FIELD: count, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    unread_cache.set(user_id, count)
+    notification_streams.publish_unread_count(user_id, count)
+
+async def get_unread_notification_count(db, user_id: str) -> int:
+    """O(1) unread count: memory first, then the counter document"""
+    count = unread_cache.get(user_id)
+    if count is not None:
+        return count
+
+    counters = await db.user_counters.find_one({"_id": user_id}, {COUNTER_FIELD: 1})
+    if counters and COUNTER_FIELD in counters:
+        count = max(counters[COUNTER_FIELD], 0)
+        unread_cache.set(user_id, count)
+        return count
+    # First read for a user from before counters existed: seed from the real count once
+    return (await _seed_counters(db, [user_id]))[user_id]
+
+async def reconcile_unread_notifications(db, batch_size: int = 200) -> Dict[str, int]:
+    """Recount unread notifications per user in batches and repair drifted counters"""
+    stats = {"users": 0, "users_fixed": 0}
+
+    async def repair_batch(user_ids: List[str]):
+        actual = await _count_unread(db, user_ids)
+        drifted = await repair_counters(db.user_counters, COUNTER_FIELD, actual, {"_id": {"$in": user_ids}})
+        stats["users_fixed"] += len(drifted)
+        for user_id in drifted:
+            unread_cache.pop(user_id)
+
+    stats["users"] = await reconcile_in_batches(db, repair_batch, batch_size)
+    logger.info("Reconciled unread notification counters", extra=stats)
+    return stats
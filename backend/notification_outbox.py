@@ -0,0 +1,198 @@
+# Notification Delivery Outbox for HayvanPazarı
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import uuid
+
+from pymongo import UpdateOne
+
+from user_cache import user_summaries
+
+logger = logging.getLogger(__name__)
+
+# Expo accepts at most 100 messages per push request
+OUTBOX_BATCH_SIZE = 100
+MAX_DELIVERY_ATTEMPTS = 5
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+POLL_INTERVAL_SECONDS = 5
+# A claimed batch becomes due again if its worker has not recorded results by then
+CLAIM_LEASE = timedelta(minutes=5)
+
+CHANNELS = ("push", "email")
+
+
+class DeliveryProvider(ABC):
+    """Sends one batch of notifications over a channel and reports per-notification success"""
+
+    @abstractmethod
+    async def send_batch(self, db, notification_docs: List[Dict[str, Any]]) -> List[bool]:
+        ...
+
+
+class MockPushProvider(DeliveryProvider):
+    """Stand-in for Expo Push Notifications"""
+
+    async def send_batch(self, db, notification_docs: List[Dict[str, Any]]) -> List[bool]:
+        for doc in notification_docs:
+            logger.info("Mock push sent", extra={"user_id": doc["user_id"], "title": doc["title"]})
+        return [True] * len(notification_docs)
+
+
+class MockEmailProvider(DeliveryProvider):
+    """Stand-in for the email service"""
+
+    async def send_batch(self, db, notification_docs: List[Dict[str, Any]]) -> List[bool]:
+        users = await user_summaries.get_many(db, [doc["user_id"] for doc in notification_docs])
+        results = []
+        for doc in notification_docs:
+            user = users.get(doc["user_id"])
+            if user and user["email"]:
+                logger.info("Mock email sent", extra={"user_id": doc["user_id"], "title": doc["title"]})
+            # A user without an address is not worth retrying
+            results.append(True)
+        return results
+
+
+def outbox_entry(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Pending delivery for one channel, stored inside the notification document"""
+    return {"next_at": now or datetime.utcnow(), "attempts": 0}
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(RETRY_BASE_DELAY * (2 ** attempts), RETRY_MAX_DELAY)
+
+
+class OutboxDispatcher:
+    """Drains pending deliveries from notification documents in provider-sized batches.
+
+    A notification is written together with its outbox entries (notification["outbox"][channel]),
+    so enqueueing needs no extra round trip and nothing is lost if the process dies before sending.
+    Each batch is claimed before it is sent, so several workers (or an overlapping notify()) never
+    send the same notification twice.
+    """
+
+    def __init__(self, providers: Dict[str, DeliveryProvider], batch_size: int = OUTBOX_BATCH_SIZE):
+        self.providers = providers
+        self.batch_size = batch_size
+        self._db = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = {channel: 0 for channel in CHANNELS}
+        self.failed = {channel: 0 for channel in CHANNELS}
+        self.batches = 0
+
+    def set_provider(self, channel: str, provider: DeliveryProvider):
+        self.providers[channel] = provider
+
+    async def start(self, db):
+        self._db = db
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox dispatcher started", extra={"batch_size": self.batch_size})
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        """Wake the dispatcher after new outbox entries were written"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                dispatched = await self.dispatch_once(self._db)
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+                dispatched = 0
+            if dispatched:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self, db) -> int:
+        """Send one due batch per channel; returns how many notifications were attempted"""
+        attempted = 0
+        for channel in CHANNELS:
+            provider = self.providers.get(channel)
+            if not provider:
+                continue
+            now = datetime.utcnow()
+            field = f"outbox.{channel}"
+            token, docs = await self._claim(db, field, now)
+            if not docs:
+                continue
+            claim = {f"{field}.claim": token}
+
+            try:
+                results = await provider.send_batch(db, docs)
+            except Exception:
+                logger.exception("Delivery provider failed", extra={"channel": channel, "batch": len(docs)})
+                results = [False] * len(docs)
+
+            # Record every result of the batch with a single bulk_write
+            operations = []
+            for doc, ok in zip(docs, results):
+                attempts = doc["outbox"][channel].get("attempts", 0) + 1
+                # Matching on the claim drops results of a worker whose lease ran out
+                if ok:
+                    operations.append(UpdateOne(
+                        {"_id": doc["_id"], **claim},
+                        {"$set": {f"is_{channel}_sent": True}, "$unset": {field: ""}}
+                    ))
+                    self.sent[channel] += 1
+                elif attempts >= MAX_DELIVERY_ATTEMPTS:
+                    operations.append(UpdateOne(
+                        {"_id": doc["_id"], **claim},
+                        {"$set": {f"{channel}_failed": True}, "$unset": {field: ""}}
+                    ))
+                    self.failed[channel] += 1
+                else:
+                    operations.append(UpdateOne(
+                        {"_id": doc["_id"], **claim},
+                        {
+                            "$set": {f"{field}.attempts": attempts, f"{field}.next_at": now + retry_delay(attempts)},
+                            "$unset": {f"{field}.claim": ""}
+                        }
+                    ))
+            await db.notifications.bulk_write(operations, ordered=False)
+            self.batches += 1
+            attempted += len(docs)
+        return attempted
+
+    async def _claim(self, db, field: str, now: datetime) -> Tuple[str, List[Dict[str, Any]]]:
+        """Take up to batch_size due deliveries for this worker.
+
+        The claim moves next_at out by CLAIM_LEASE, which hides the rows from other workers and
+        makes them due again if this one dies; only rows still due at update time are taken.
+        """
+        candidates = await db.notifications.find(
+            {f"{field}.next_at": {"$lte": now}},
+            {"_id": 1}
+        ).sort(f"{field}.next_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        token = uuid.uuid4().hex
+        if not candidates:
+            return token, []
+        await db.notifications.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, f"{field}.next_at": {"$lte": now}},
+            {"$set": {f"{field}.claim": token, f"{field}.next_at": now + CLAIM_LEASE}}
+        )
+        docs = await db.notifications.find(
+            {f"{field}.claim": token},
+            {"user_id": 1, "title": 1, "message": 1, "data": 1, "priority": 1, "type": 1, field: 1}
+        ).to_list(self.batch_size)
+        return token, docs
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sent": dict(self.sent), "failed": dict(self.failed), "batches": self.batches}
+
+
+outbox_dispatcher = OutboxDispatcher({"push": MockPushProvider(), "email": MockEmailProvider()})
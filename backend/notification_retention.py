@@ -0,0 +1,92 @@
+# Notification Retention for HayvanPazarı
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+import logging
+import os
+
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# Read low-priority notifications are removed by a TTL index after this long
+LOW_PRIORITY_READ_TTL = timedelta(days=int(os.environ.get('NOTIFICATION_LOW_TTL_DAYS', 30)))
+TTL_INDEX_NAME = "read_low_priority_ttl"
+# Other read/archived notifications move to the cold collection after this long
+ARCHIVE_AFTER = timedelta(days=int(os.environ.get('NOTIFICATION_ARCHIVE_DAYS', 90)))
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_COLLECTION = "notifications_archive"
+
+DUPLICATE_KEY = 11000
+
+
+async def ensure_retention_indexes(db):
+    """TTL index for read low-priority notifications and a compressed archive collection"""
+    ttl_seconds = int(LOW_PRIORITY_READ_TTL.total_seconds())
+    existing = (await db.notifications.index_information()).get(TTL_INDEX_NAME)
+    if existing and existing.get("expireAfterSeconds") != ttl_seconds:
+        # NOTIFICATION_LOW_TTL_DAYS changed: create_index would fail with IndexOptionsConflict
+        await db.command({"collMod": "notifications", "index": {"name": TTL_INDEX_NAME, "expireAfterSeconds": ttl_seconds}})
+        logger.info("Updated notification TTL", extra={"from": existing.get("expireAfterSeconds"), "to": ttl_seconds})
+    else:
+        await db.notifications.create_index(
+            "read_at",
+            name=TTL_INDEX_NAME,
+            expireAfterSeconds=ttl_seconds,
+            partialFilterExpression={"priority": "low", "status": "read"}
+        )
+
+    try:
+        # Cold data is rarely read; zstd trades a little CPU for much less disk
+        await db.create_collection(
+            ARCHIVE_COLLECTION,
+            storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+        )
+    except CollectionInvalid:
+        pass
+    await db[ARCHIVE_COLLECTION].create_index([("user_id", 1), ("created_at", -1)])
+
+async def archive_notifications(db, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move old read/archived notifications to the archive collection in batches"""
+    archived = 0
+    cutoff = datetime.utcnow() - ARCHIVE_AFTER
+    while True:
+        docs = await db.notifications.find(
+            {"status": {"$in": ["read", "archived"]}, "created_at": {"$lt": cutoff}},
+            {"outbox": 0}
+        ).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        now = datetime.utcnow()
+        for doc in docs:
+            doc["archived_at"] = now
+        try:
+            await db[ARCHIVE_COLLECTION].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Already copied by an interrupted earlier run; anything else must stop the job
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+
+        # Only delete what is now safely in the archive
+        await db.notifications.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        archived += len(docs)
+
+    if archived:
+        logger.info("Archived notifications", extra={"archived": archived, "cutoff": cutoff})
+    return archived
+
+async def find_archived_notifications(
+    db,
+    query: Dict[str, Any],
+    limit: int,
+    projection: Optional[Dict[str, Any]] = None,
+    sort_direction: int = -1,
+    sort_field: str = "created_at"
+) -> List[Dict[str, Any]]:
+    return await db[ARCHIVE_COLLECTION].find(query, projection).sort(
+        [(sort_field, sort_direction), ("_id", sort_direction)]
+    ).limit(limit).to_list(limit)
+
+async def delete_archived_notifications(db, query: Dict[str, Any]) -> int:
+    result = await db[ARCHIVE_COLLECTION].delete_many(query)
+    return result.deleted_count
@@ -0,0 +1,89 @@
+# Deferred Notification Scheduler for HayvanPazarı
+from typing import List, Optional, Callable, Awaitable
+from datetime import datetime
+import asyncio
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+RELEASE_BATCH_SIZE = 500
+
+
+class DeliveryScheduler:
+    """Min-heap of (deliver_at, notification_id) that releases due notifications in batches.
+
+    Mongo stays the source of truth: deferred notifications carry delivery_status="deferred"
+    and deliver_at, so the heap is rebuilt from an indexed query on startup.
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+        self._release: Optional[Callable[..., Awaitable[int]]] = None
+        self.released = 0
+
+    async def start(self, db, release: Callable[..., Awaitable[int]]):
+        """Load pending deferred notifications and start the release loop"""
+        self._db = db
+        self._release = release
+        self._wakeup = asyncio.Event()
+        self._heap = []
+        cursor = db.notifications.find(
+            {"delivery_status": "deferred"},
+            {"deliver_at": 1}
+        ).sort("deliver_at", 1)
+        async for notification in cursor:
+            self._heap.append((notification["deliver_at"], notification["_id"]))
+        heapq.heapify(self._heap)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Delivery scheduler started", extra={"deferred": len(self._heap)})
+
+    def schedule(self, deliver_at: datetime, notification_id: str):
+        heapq.heappush(self._heap, (deliver_at, notification_id))
+        # Wake the loop if this is now the earliest entry
+        if self._wakeup and self._heap[0][1] == notification_id:
+            self._wakeup.set()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = datetime.utcnow()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < RELEASE_BATCH_SIZE:
+                due.append(heapq.heappop(self._heap)[1])
+            try:
+                self.released += await self._release(self._db, due)
+            except Exception:
+                logger.exception("Releasing deferred notifications failed", extra={"count": len(due)})
+                # Put them back and retry shortly
+                retry_at = datetime.utcnow()
+                for notification_id in due:
+                    heapq.heappush(self._heap, (retry_at, notification_id))
+                await asyncio.sleep(5)
+
+
+delivery_scheduler = DeliveryScheduler()
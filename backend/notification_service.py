@@ -1,9 +1,26 @@
 # Notification Service for HayvanPazarı
 from enum import Enum
-from typing import Dict, Any, Optional
-from datetime import datetime
+from typing import Dict, Any, Optional, Iterable, List
+from datetime import datetime, time as clock_time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import copy
+import logging
+import time
 import uuid
 
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from job_queue import idempotent
+from notification_counters import adjust_unread_notifications, increment_unread_notifications_bulk
+from notification_outbox import outbox_dispatcher, outbox_entry
+from notification_stream import notification_streams
+from notification_scheduler import delivery_scheduler
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
 
 class NotificationType(str, Enum):
     MESSAGE = "message"
@@ -24,19 +41,63 @@ class NotificationStatus(str, Enum):
     READ = "read"
     ARCHIVED = "archived"
 
+# Key in settings["notification_types"] that switches each type on or off
+NOTIFICATION_TYPE_SETTINGS = {
+    NotificationType.MESSAGE: "messages",
+    NotificationType.OFFER: "offers",
+    NotificationType.LISTING: "listings",
+    NotificationType.SECURITY: "security",
+    NotificationType.PAYMENT: "payments",
+    NotificationType.PROFILE: "profile",
+}
 
-async def create_notification(
-    db,
-    user_id: str, 
-    notification_type: NotificationType, 
+DEFAULT_NOTIFICATION_SETTINGS = {
+    "email_notifications": True,
+    "push_notifications": True,
+    "sound_enabled": True,
+    "vibration_enabled": True,
+    "quiet_hours_enabled": False,
+    "quiet_hours_start": "22:00",
+    "quiet_hours_end": "08:00",
+    "timezone": "Europe/Istanbul",
+    "notification_types": {
+        "messages": True,
+        "offers": True,
+        "listings": True,
+        "security": True,
+        "payments": True,
+        "profile": True
+    }
+}
+
+# Settings are read on every notification but only change via PUT /notifications/settings
+settings_cache = TTLCache(maxsize=10000, ttl_seconds=600)
+
+# Bursts of chat/offer notifications from one sender about one listing merge into one.
+# The notification absorbing a burst carries coalesce_open=True; a unique partial index on
+# coalesce_key over those documents makes the merge-or-insert upsert atomic across workers.
+COALESCE_WINDOW = timedelta(seconds=600)
+COALESCED_TYPES = {NotificationType.MESSAGE, NotificationType.OFFER}
+
+# Recipients handled per insert_many/settings round trip in bulk fan-out
+FANOUT_CHUNK_SIZE = 1000
+# Dedupe keys remembered on an open coalesced notification, so a retried job is not merged twice
+COALESCE_SOURCES_KEPT = 50
+
+
+def new_notification_doc(
+    user_id: str,
+    notification_type: NotificationType,
     priority: NotificationPriority,
-    title: str, 
-    message: str, 
-    data: Optional[Dict[str, Any]] = None
-) -> str:
-    """Create a new notification"""
-    notification_doc = {
-        "_id": str(uuid.uuid4()),
+    title: str,
+    message: str,
+    data: Optional[Dict[str, Any]] = None,
+    dedupe_key: Optional[str] = None
+) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    return {
+        # The same event for the same user always gets the same _id, so a retried job cannot store it twice
+        "_id": f"{dedupe_key}:{user_id}" if dedupe_key else str(uuid.uuid4()),
         "user_id": user_id,
         "type": notification_type,
         "priority": priority,
@@ -46,102 +107,368 @@ async def create_notification(
         "status": NotificationStatus.UNREAD,
         "is_email_sent": False,
         "is_push_sent": False,
-        "created_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
         "read_at": None
     }
+
+def wants_push(settings: Dict[str, Any]) -> bool:
+    return settings.get("push_notifications", True)
+
+def wants_email(settings: Dict[str, Any], priority: NotificationPriority) -> bool:
+    """Email only goes out for critical and high priority"""
+    return priority in [NotificationPriority.CRITICAL, NotificationPriority.HIGH] and settings.get("email_notifications", True)
+
+def delivery_outbox(settings: Dict[str, Any], priority: NotificationPriority, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Outbox entries (one per channel) to store inside the notification document"""
+    outbox = {}
+    if wants_push(settings):
+        outbox["push"] = outbox_entry(now)
+    if wants_email(settings, priority):
+        outbox["email"] = outbox_entry(now)
+    return outbox
+
+def coalesce_key(user_id: str, notification_type: NotificationType, data: Optional[Dict[str, Any]]) -> Optional[str]:
+    if notification_type not in COALESCED_TYPES or not data:
+        return None
+    if not data.get("sender_id") or not data.get("listing_id"):
+        return None
+    return f"{user_id}:{data['sender_id']}:{data['listing_id']}:{notification_type.value}"
+
+async def coalesce_notification(
+    db,
+    key: str,
+    notification_doc: Dict[str, Any],
+    dedupe_key: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Merge into the open notification for `key`, or insert notification_doc as the new one.
+
+    Returns the stored document; coalesced_count == 1 means it was just inserted.
+    None means an earlier attempt already stored `dedupe_key`.
+    """
+    now = notification_doc["created_at"]
+    # A window ends when its notification is read or the window runs out
+    await db.notifications.update_many(
+        {"coalesce_key": key, "coalesce_open": True, "$or": [
+            {"status": {"$ne": NotificationStatus.UNREAD}},
+            {"coalesce_until": {"$lte": now}}
+        ]},
+        {"$unset": {"coalesce_open": ""}}
+    )
+    merged = {"title", "message", "data", "updated_at"}
+    matched = {"coalesce_key", "coalesce_open", "coalesced_count"}
+    query = {"coalesce_key": key, "coalesce_open": True}
+    update = {
+        "$set": {field: notification_doc[field] for field in merged},
+        "$inc": {"coalesced_count": 1},
+        "$setOnInsert": {
+            **{field: value for field, value in notification_doc.items() if field not in merged | matched},
+            "coalesce_until": now + COALESCE_WINDOW
+        }
+    }
+    if dedupe_key:
+        query["coalesce_sources"] = {"$ne": dedupe_key}
+        update["$push"] = {"coalesce_sources": {"$each": [dedupe_key], "$slice": -COALESCE_SOURCES_KEPT}}
+    for attempt in range(2):
+        try:
+            return await db.notifications.find_one_and_update(
+                query,
+                update,
+                projection={"outbox": 0, "coalesce_sources": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Already merged (or inserted) by an earlier attempt of the same job
+            if dedupe_key and await db.notifications.find_one(
+                {"$or": [
+                    {"_id": notification_doc["_id"]},
+                    {"coalesce_key": key, "coalesce_open": True, "coalesce_sources": dedupe_key}
+                ]},
+                {"_id": 1}
+            ):
+                return None
+            # Another worker inserted the open notification first; merge into it
+            if attempt:
+                raise
+
+@idempotent
+async def create_notification(
+    db,
+    user_id: str, 
+    notification_type: NotificationType, 
+    priority: NotificationPriority,
+    title: str, 
+    message: str, 
+    data: Optional[Dict[str, Any]] = None,
+    dedupe_key: Optional[str] = None
+) -> Optional[str]:
+    """Create a new notification; returns None if the user has turned this type off.
+
+    With a dedupe_key (e.g. "message:<id>") a repeated call stores, counts and delivers nothing
+    new, which is what makes it safe to retry on notification_jobs; every queued call passes one.
+    """
+    settings = await get_user_notification_settings(db, user_id)
+    if not is_notification_enabled(settings, notification_type, priority):
+        logger.debug("Suppressed notification", extra={"user_id": user_id, "type": notification_type})
+        return None
     
-    result = await db.notifications.insert_one(notification_doc)
-    print(f"🔔 Created notification: {title} for user {user_id}")
+    notification_doc = new_notification_doc(user_id, notification_type, priority, title, message, data, dedupe_key)
+    deliver_at = deferred_until(settings, priority)
+    if deliver_at:
+        mark_deferred(notification_doc, deliver_at)
+    else:
+        # Delivery is queued in the same write as the notification itself
+        notification_doc["outbox"] = delivery_outbox(settings, priority)
     
-    # Send notification based on priority
-    await send_notification(db, notification_doc)
+    key = coalesce_key(user_id, notification_type, data)
+    if key:
+        # Same sender and listing within the window: update the unread notification, no new delivery
+        notification_doc.update({"coalesce_key": key, "coalesce_open": True})
+        stored = await coalesce_notification(db, key, notification_doc, dedupe_key)
+        if stored is None:
+            return None
+        if stored["coalesced_count"] > 1:
+            stored["title"] = f"{title} ({stored['coalesced_count']})"
+            await db.notifications.update_one(
+                {"_id": stored["_id"], "coalesced_count": stored["coalesced_count"]},
+                {"$set": {"title": stored["title"]}}
+            )
+            notification_streams.publish(user_id, "notification_updated", {
+                "id": stored["_id"],
+                "title": stored["title"],
+                "message": stored["message"],
+                "data": stored["data"],
+                "coalesced_count": stored["coalesced_count"],
+                "updated_at": stored["updated_at"]
+            })
+            return stored["_id"]
+    elif dedupe_key:
+        # Only the attempt that inserts publishes and counts; the outbox entries are already stored
+        result = await db.notifications.update_one(
+            {"_id": notification_doc["_id"]},
+            {"$setOnInsert": notification_doc},
+            upsert=True
+        )
+        if result.upserted_id is None:
+            outbox_dispatcher.notify()
+            return None
+    else:
+        await db.notifications.insert_one(notification_doc)
     
-    return str(result.inserted_id)
-
-async def send_notification(db, notification_doc: Dict[str, Any]):
-    """Send notification via appropriate channels based on priority"""
-    user_id = notification_doc["user_id"]
-    priority = notification_doc["priority"]
+    notification_streams.publish_notification(notification_doc)
+    await adjust_unread_notifications(db, user_id, 1)
+    logger.debug("Created notification", extra={"user_id": user_id, "type": notification_type, "title": title})
     
-    # Get user notification settings
-    settings = await get_user_notification_settings(db, user_id)
+    # Send notification based on priority, or hold it until quiet hours end
+    if deliver_at:
+        delivery_scheduler.schedule(deliver_at, notification_doc["_id"])
+    elif notification_doc["outbox"]:
+        outbox_dispatcher.notify()
     
-    # Check quiet hours
-    if is_quiet_hours(settings):
-        if priority != NotificationPriority.CRITICAL:
-            print(f"⏰ Notification delayed due to quiet hours: {notification_doc['title']}")
-            return
+    return notification_doc["_id"]
+
+async def create_notifications_bulk(
+    db,
+    user_ids: Iterable[str],
+    notification_type: NotificationType,
+    priority: NotificationPriority,
+    title: str,
+    message: str,
+    data: Optional[Dict[str, Any]] = None,
+    dedupe_key: Optional[str] = None
+) -> Dict[str, Any]:
+    """Fan one notification template out to many recipients in chunked bulk writes.
+
+    With a dedupe_key, recipients an earlier attempt already reached are skipped, not notified twice.
+    """
+    started = time.perf_counter()
+    recipients = list(dict.fromkeys(user_ids))
+    stats = {"recipients": len(recipients), "created": 0, "suppressed": 0, "push": 0, "email": 0, "deferred": 0}
     
-    # Send push notification
-    if settings.get("push_notifications", True) and not notification_doc["is_push_sent"]:
-        await send_push_notification(db, notification_doc, settings)
+    for offset in range(0, len(recipients), FANOUT_CHUNK_SIZE):
+        chunk = recipients[offset:offset + FANOUT_CHUNK_SIZE]
+        settings_by_user = await get_many_notification_settings(db, chunk)
+        
+        docs = []
+        deferred_docs: List[Dict[str, Any]] = []
+        now = datetime.utcnow()
+        for user_id in chunk:
+            settings = settings_by_user[user_id]
+            if not is_notification_enabled(settings, notification_type, priority):
+                stats["suppressed"] += 1
+                continue
+            doc = new_notification_doc(user_id, notification_type, priority, title, message, data, dedupe_key)
+            docs.append(doc)
+            
+            # Group recipients by delivery channel
+            deliver_at = deferred_until(settings, priority, now)
+            if deliver_at:
+                mark_deferred(doc, deliver_at)
+                deferred_docs.append(doc)
+                continue
+            doc["outbox"] = delivery_outbox(settings, priority, now)
+            for channel in doc["outbox"]:
+                stats[channel] += 1
+        
+        if not docs:
+            continue
+        try:
+            await db.notifications.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if not dedupe_key or any(error.get("code") != 11000 for error in errors):
+                raise
+            # Stored by an earlier attempt of this fan-out; continue with the rest only
+            existing = {docs[error["index"]]["_id"] for error in errors}
+            docs = [doc for doc in docs if doc["_id"] not in existing]
+            deferred_docs = [doc for doc in deferred_docs if doc["_id"] not in existing]
+            if not docs:
+                continue
+        for doc in docs:
+            notification_streams.publish_notification(doc)
+        await increment_unread_notifications_bulk(db, [doc["user_id"] for doc in docs])
+        stats["created"] += len(docs)
+        
+        for doc in deferred_docs:
+            delivery_scheduler.schedule(doc["deliver_at"], doc["_id"])
+        stats["deferred"] += len(deferred_docs)
+        outbox_dispatcher.notify()
     
-    # Send email for critical and high priority
-    if priority in [NotificationPriority.CRITICAL, NotificationPriority.HIGH]:
-        if settings.get("email_notifications", True) and not notification_doc["is_email_sent"]:
-            await send_email_notification(db, notification_doc)
+    elapsed = time.perf_counter() - started
+    stats["elapsed_ms"] = round(elapsed * 1000, 1)
+    stats["per_second"] = round(stats["recipients"] / elapsed, 1) if elapsed > 0 else None
+    logger.info("Notification fan-out", extra={"title": title, "stats": stats})
+    return stats
 
 async def get_user_notification_settings(db, user_id: str) -> Dict[str, Any]:
-    """Get user notification settings or defaults"""
-    settings = await db.notification_settings.find_one({"user_id": user_id})
-    if not settings:
-        # Create default settings
-        default_settings = {
-            "user_id": user_id,
-            "email_notifications": True,
-            "push_notifications": True,
-            "sound_enabled": True,
-            "vibration_enabled": True,
-            "quiet_hours_enabled": False,
-            "quiet_hours_start": "22:00",
-            "quiet_hours_end": "08:00",
-            "notification_types": {
-                "messages": True,
-                "offers": True,
-                "listings": True,
-                "security": True,
-                "payments": True,
-                "profile": True
-            }
-        }
-        await db.notification_settings.insert_one(default_settings)
-        return default_settings
-    return settings
+    """Get user notification settings or defaults, served from settings_cache when possible"""
+    settings = settings_cache.get(user_id)
+    if settings is None:
+        settings = await db.notification_settings.find_one({"user_id": user_id}, {"_id": 0})
+        if not settings:
+            # Create default settings; $setOnInsert keeps concurrent first uses from clobbering each other
+            settings = {"user_id": user_id, **copy.deepcopy(DEFAULT_NOTIFICATION_SETTINGS)}
+            try:
+                await db.notification_settings.update_one(
+                    {"user_id": user_id},
+                    {"$setOnInsert": settings},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                pass
+        else:
+            # Older documents may miss newer keys
+            settings = {**copy.deepcopy(DEFAULT_NOTIFICATION_SETTINGS), **settings}
+        settings_cache.set(user_id, settings)
+    return copy.deepcopy(settings)
+
+async def get_many_notification_settings(db, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Settings for many users with one $in query; users without a document get the defaults"""
+    found: Dict[str, Dict[str, Any]] = {}
+    missing = []
+    for user_id in user_ids:
+        settings = settings_cache.get(user_id)
+        if settings is not None:
+            found[user_id] = settings
+        else:
+            missing.append(user_id)
+    
+    if missing:
+        async for settings in db.notification_settings.find({"user_id": {"$in": missing}}, {"_id": 0}):
+            settings = {**copy.deepcopy(DEFAULT_NOTIFICATION_SETTINGS), **settings}
+            settings_cache.set(settings["user_id"], settings)
+            found[settings["user_id"]] = settings
+        for user_id in missing:
+            if user_id not in found:
+                # Not persisted here: a missing document already means "defaults"
+                found[user_id] = {"user_id": user_id, **copy.deepcopy(DEFAULT_NOTIFICATION_SETTINGS)}
+    return found
+
+def invalidate_notification_settings(user_id: str):
+    settings_cache.pop(user_id)
+
+def is_notification_enabled(settings: Dict[str, Any], notification_type: NotificationType, priority: NotificationPriority) -> bool:
+    """Apply the user's per-type preferences; critical notifications always go through"""
+    if priority == NotificationPriority.CRITICAL:
+        return True
+    type_key = NOTIFICATION_TYPE_SETTINGS.get(notification_type)
+    return settings.get("notification_types", {}).get(type_key, True)
+
+@lru_cache(maxsize=256)
+def parse_clock(value: str) -> clock_time:
+    """Parse "HH:MM" once; there are only a handful of distinct values"""
+    return datetime.strptime(value, "%H:%M").time()
 
-def is_quiet_hours(settings: Dict[str, Any]) -> bool:
-    """Check if current time is within quiet hours"""
+@lru_cache(maxsize=256)
+def get_timezone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_NOTIFICATION_SETTINGS["timezone"])
+
+def user_local_time(settings: Dict[str, Any], now_utc: Optional[datetime] = None) -> datetime:
+    """Current time in the user's timezone (now_utc is naive UTC like the rest of the app)"""
+    now_utc = now_utc or datetime.utcnow()
+    zone = get_timezone(settings.get("timezone") or DEFAULT_NOTIFICATION_SETTINGS["timezone"])
+    return now_utc.replace(tzinfo=timezone.utc).astimezone(zone)
+
+def is_quiet_hours(settings: Dict[str, Any], now_utc: Optional[datetime] = None) -> bool:
+    """Check if current time is within quiet hours in the user's timezone"""
     if not settings.get("quiet_hours_enabled", False):
         return False
     
-    now = datetime.now().time()
-    start_time = datetime.strptime(settings.get("quiet_hours_start", "22:00"), "%H:%M").time()
-    end_time = datetime.strptime(settings.get("quiet_hours_end", "08:00"), "%H:%M").time()
+    now = user_local_time(settings, now_utc).time().replace(tzinfo=None)
+    start_time = parse_clock(settings.get("quiet_hours_start", "22:00"))
+    end_time = parse_clock(settings.get("quiet_hours_end", "08:00"))
     
     if start_time <= end_time:
         return start_time <= now <= end_time
     else:  # Crosses midnight
         return now >= start_time or now <= end_time
 
-async def send_push_notification(db, notification_doc: Dict[str, Any], settings: Dict[str, Any]):
-    """Send push notification (mock implementation for now)"""
-    # This would integrate with Expo Push Notifications in production
-    print(f"📱 PUSH: {notification_doc['title']} - {notification_doc['message']}")
+def deferred_until(
+    settings: Dict[str, Any],
+    priority: NotificationPriority,
+    now_utc: Optional[datetime] = None
+) -> Optional[datetime]:
+    """When a notification held by quiet hours should go out (naive UTC), or None to send now"""
+    if priority == NotificationPriority.CRITICAL or not is_quiet_hours(settings, now_utc):
+        return None
     
-    # Update notification as sent
-    await db.notifications.update_one(
-        {"_id": notification_doc["_id"]},
-        {"$set": {"is_push_sent": True}}
-    )
+    local_now = user_local_time(settings, now_utc)
+    end_time = parse_clock(settings.get("quiet_hours_end", "08:00"))
+    deliver_local = local_now.replace(hour=end_time.hour, minute=end_time.minute, second=0, microsecond=0)
+    if deliver_local <= local_now:
+        deliver_local += timedelta(days=1)
+    return deliver_local.astimezone(timezone.utc).replace(tzinfo=None)
+
+def mark_deferred(notification_doc: Dict[str, Any], deliver_at: datetime):
+    notification_doc["delivery_status"] = "deferred"
+    notification_doc["deliver_at"] = deliver_at
 
-async def send_email_notification(db, notification_doc: Dict[str, Any]):
-    """Send email notification (mock implementation for now)"""
-    # This would integrate with email service in production
-    user = await db.users.find_one({"_id": notification_doc["user_id"]})
-    if user:
-        print(f"📧 EMAIL to {user['email']}: {notification_doc['title']} - {notification_doc['message']}")
+async def release_deferred_notifications(db, notification_ids: List[str]) -> int:
+    """Hand notifications whose quiet hours have ended to the outbox (called by delivery_scheduler)"""
+    docs = await db.notifications.find(
+        {"_id": {"$in": notification_ids}, "delivery_status": "deferred"},
+        {"user_id": 1, "priority": 1}
+    ).to_list(len(notification_ids))
+    if not docs:
+        return 0
+    
+    settings_by_user = await get_many_notification_settings(db, list({doc["user_id"] for doc in docs}))
+    now = datetime.utcnow()
+    await db.notifications.bulk_write([
+        UpdateOne(
+            {"_id": doc["_id"], "delivery_status": "deferred"},
+            {"$set": {
+                "delivery_status": "released",
+                "outbox": delivery_outbox(settings_by_user[doc["user_id"]], doc["priority"], now)
+            }}
+        )
+        for doc in docs
+    ], ordered=False)
+    outbox_dispatcher.notify()
     
-    # Update notification as sent
-    await db.notifications.update_one(
-        {"_id": notification_doc["_id"]},
-        {"$set": {"is_email_sent": True}}
-    )
\ No newline at end of file
+    logger.info("Released deferred notifications", extra={"count": len(docs)})
+    return len(docs)
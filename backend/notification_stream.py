@@ -0,0 +1,115 @@
+# Notification Event Stream (SSE) for HayvanPazarı
+from typing import Dict, Any, Optional, Set, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import json
+
+HEARTBEAT_SECONDS = 20
+STREAM_QUEUE_SIZE = 100
+RETRY_MILLISECONDS = 5000
+REPLAY_LIMIT = 100
+# Bookkeeping fields on notification documents that clients never see
+INTERNAL_FIELDS = ("_id", "outbox", "coalesce_key", "coalesce_open", "coalesce_until")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def event_id_for(created_at: datetime, notification_id: Any) -> str:
+    """Notifications are replayed by (created_at, _id), so that pair is the SSE event id.
+
+    Milliseconds, because that is what Mongo stores; the _id breaks ties within one millisecond.
+    """
+    return f"{(created_at.replace(tzinfo=None) - EPOCH) // MILLISECOND}:{notification_id}"
+
+def parse_event_id(event_id: str) -> Optional[Tuple[datetime, Optional[str]]]:
+    """(created_at, _id) from an event id; ids from before the _id was added carry only the time"""
+    millis, _, notification_id = event_id.partition(":")
+    try:
+        return EPOCH + int(millis) * MILLISECOND, notification_id or None
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def format_event(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=_json_default, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+def notification_payload(notification_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Same shape as GET /notifications items"""
+    payload = {key: value for key, value in notification_doc.items() if key not in INTERNAL_FIELDS}
+    payload["id"] = str(notification_doc["_id"])
+    return payload
+
+
+class StreamRegistry:
+    """Per-process map of user_id → open SSE connections.
+
+    Each connection is only a small bounded queue; events are formatted once per publish
+    and shared by all of a user's connections. Queue items are (key, message) pairs, where
+    key is the notification id, so a reconnect's replay can drop events it already sent.
+    """
+
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._streams: Dict[str, Set[asyncio.Queue]] = {}
+        self.dropped = 0
+
+    def connect(self, user_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._streams.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def disconnect(self, user_id: str, queue: asyncio.Queue):
+        queues = self._streams.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._streams[user_id]
+
+    def has_listeners(self, user_id: str) -> bool:
+        return user_id in self._streams
+
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self._streams.values())
+
+    def publish(self, user_id: str, event: str, data: Any, event_id: Optional[str] = None, key: Optional[str] = None):
+        queues = self._streams.get(user_id)
+        if not queues:
+            return
+        message = format_event(event, data, event_id)
+        for queue in list(queues):
+            try:
+                queue.put_nowait((key, message))
+            except asyncio.QueueFull:
+                # Slow client: end its stream; it reconnects and resumes via Last-Event-ID
+                self.dropped += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def publish_notification(self, notification_doc: Dict[str, Any]):
+        if self.has_listeners(notification_doc["user_id"]):
+            self.publish(
+                notification_doc["user_id"],
+                "notification",
+                notification_payload(notification_doc),
+                event_id_for(notification_doc["created_at"], notification_doc["_id"]),
+                key=str(notification_doc["_id"])
+            )
+
+    def publish_unread_count(self, user_id: str, count: int):
+        self.publish(user_id, "unread_count", {"unread_count": count})
+
+
+notification_streams = StreamRegistry()
@@ -0,0 +1,154 @@
+# Offer Service for HayvanPazarı
+from enum import Enum
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class OfferStatus(str, Enum):
+    OPEN = "open"
+    ACCEPTED = "accepted"
+    REJECTED = "rejected"
+    EXPIRED = "expired"
+
+# Only open offers can move; every other state is final
+OFFER_TRANSITIONS = {
+    OfferStatus.OPEN: {OfferStatus.ACCEPTED, OfferStatus.REJECTED, OfferStatus.EXPIRED},
+    OfferStatus.ACCEPTED: set(),
+    OfferStatus.REJECTED: set(),
+    OfferStatus.EXPIRED: set(),
+}
+
+OFFER_TTL = timedelta(days=7)
+
+
+def offer_summary(offer: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact offer view stored on the listing document"""
+    return {
+        "offer_id": offer["_id"],
+        "amount": offer["amount"],
+        "buyer_id": offer["buyer_id"],
+        "created_at": offer["created_at"]
+    }
+
+async def create_offer(
+    db,
+    listing: Dict[str, Any],
+    buyer_id: str,
+    amount: float,
+    message_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Store an open offer and fold it into the listing's best-offer summary"""
+    now = datetime.utcnow()
+    offer_doc = {
+        "_id": str(uuid.uuid4()),
+        "listing_key": listing["_id"],
+        "listing_id": listing.get("id") or str(listing["_id"]),
+        "seller_id": listing["seller_id"],
+        "buyer_id": buyer_id,
+        "amount": amount,
+        "message_id": message_id,
+        "status": OfferStatus.OPEN,
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": now + OFFER_TTL
+    }
+    await db.offers.insert_one(offer_doc)
+
+    await db.listings.update_one({"_id": listing["_id"]}, {"$inc": {"open_offers": 1}})
+    # Only replaces the summary when this offer beats the current best
+    await db.listings.update_one(
+        {"_id": listing["_id"], "$or": [{"best_offer": None}, {"best_offer.amount": {"$lt": amount}}]},
+        {"$set": {"best_offer": offer_summary(offer_doc)}}
+    )
+
+    logger.info("Offer created", extra={"offer_id": offer_doc["_id"], "listing_id": offer_doc["listing_id"], "amount": amount})
+    return offer_doc
+
+async def refresh_best_offer(db, listing_key, replaced_offer_id: Optional[str] = None, replaced_offer_ids: Optional[List[str]] = None):
+    """Recompute best offer from open offers (uses the listing_key/status/amount index)"""
+    best = await db.offers.find_one(
+        {"listing_key": listing_key, "status": OfferStatus.OPEN},
+        sort=[("amount", -1)]
+    )
+    query = {"_id": listing_key}
+    if replaced_offer_id:
+        # Don't clobber a newer best offer written concurrently
+        query["best_offer.offer_id"] = replaced_offer_id
+    elif replaced_offer_ids:
+        query["best_offer.offer_id"] = {"$in": replaced_offer_ids}
+    await db.listings.update_one(query, {"$set": {"best_offer": offer_summary(best) if best else None}})
+
+async def transition_offer(db, offer_id: str, seller_id: str, new_status: OfferStatus) -> Optional[Dict[str, Any]]:
+    """Move an offer to a new state; returns None if the seller has no such offer"""
+    offer = await db.offers.find_one({"_id": offer_id, "seller_id": seller_id})
+    if not offer:
+        return None
+
+    current = OfferStatus(offer["status"])
+    if new_status not in OFFER_TRANSITIONS[current]:
+        raise ValueError(f"Cannot change offer from {current.value} to {new_status.value}")
+
+    now = datetime.utcnow()
+    result = await db.offers.update_one(
+        {"_id": offer_id, "status": current},
+        {"$set": {"status": new_status, "updated_at": now}}
+    )
+    if result.modified_count == 0:
+        raise ValueError("Offer was changed by another request")
+
+    listing_update = {"$inc": {"open_offers": -1}}
+    if new_status == OfferStatus.ACCEPTED:
+        listing_update["$set"] = {"accepted_offer": offer_summary(offer)}
+    await db.listings.update_one({"_id": offer["listing_key"]}, listing_update)
+    await refresh_best_offer(db, offer["listing_key"], replaced_offer_id=offer_id)
+
+    offer["status"] = new_status
+    offer["updated_at"] = now
+    return offer
+
+async def get_listing_offers(db, listing_key, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Offers on a listing, highest first"""
+    query = {"listing_key": listing_key}
+    if status:
+        query["status"] = status
+    return await db.offers.find(query).sort("amount", -1).limit(limit).to_list(limit)
+
+async def expire_offers(db, batch_size: int = 500) -> int:
+    """Expire stale open offers in batches and refresh affected listing summaries"""
+    expired = 0
+    while True:
+        now = datetime.utcnow()
+        offers = await db.offers.find(
+            {"status": OfferStatus.OPEN, "expires_at": {"$lte": now}},
+            {"listing_key": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not offers:
+            break
+
+        result = await db.offers.update_many(
+            {"_id": {"$in": [offer["_id"] for offer in offers]}, "status": OfferStatus.OPEN},
+            {"$set": {"status": OfferStatus.EXPIRED, "updated_at": now}}
+        )
+        expired += result.modified_count
+
+        # Only the offers this pass expired: one accepted or rejected meanwhile was already counted down
+        expired_by_listing: Dict[Any, List[str]] = {}
+        async for offer in db.offers.find(
+            {"_id": {"$in": [offer["_id"] for offer in offers]}, "status": OfferStatus.EXPIRED, "updated_at": now},
+            {"listing_key": 1}
+        ):
+            expired_by_listing.setdefault(offer["listing_key"], []).append(offer["_id"])
+
+        for listing_key, offer_ids in expired_by_listing.items():
+            # $inc, like create_offer and transition_offer, so a concurrent offer's own $inc is kept
+            await db.listings.update_one({"_id": listing_key}, {"$inc": {"open_offers": -len(offer_ids)}})
+            # Only when one of these was the best offer, and no newer best has replaced it
+            await refresh_best_offer(db, listing_key, replaced_offer_ids=offer_ids)
+
+    if expired:
+        logger.info("Expired offers", extra={"expired": expired})
+    return expired
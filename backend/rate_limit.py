@@ -0,0 +1,161 @@
+# Rate Limiting for HayvanPazarı
+from fastapi import HTTPException, Request, Depends
+from typing import Dict, Any, Optional, Tuple
+from datetime import datetime
+import math
+import os
+import time
+
+from pymongo import ReturnDocument
+
+from auth_context import verify_token
+
+RATE_LIMIT_MEMORY_KEYS = 100000
+# Only enable behind a proxy that overwrites X-Forwarded-For; otherwise clients can spoof it
+TRUST_FORWARDED_FOR = os.environ.get('RATE_LIMIT_TRUST_PROXY', '').lower() in ('1', 'true', 'yes')
+
+
+class RatePolicy:
+    """At most `limit` requests per `window_seconds`, overridable with e.g. RATE_LIMIT_LOGIN_IP=20/300"""
+
+    def __init__(self, name: str, limit: int, window_seconds: int):
+        override = os.environ.get(f"RATE_LIMIT_{name.upper()}")
+        if override:
+            limit, window_seconds = (int(part) for part in override.split("/"))
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+
+
+POLICIES: Dict[str, RatePolicy] = {
+    policy.name: policy for policy in (
+        RatePolicy("login_ip", 20, 300),
+        RatePolicy("login_email", 10, 300),
+        # Loose per IP: mobile carriers put many users behind one CGNAT address
+        RatePolicy("register_ip", 50, 3600),
+        RatePolicy("register_phone", 5, 3600),
+        RatePolicy("send_message_user", 30, 60),
+    )
+}
+
+
+class MemoryRateLimitBackend:
+    """Per-process window counters; fine for a single worker"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self._windows: Dict[str, Tuple[int, int, int]] = {}
+
+    async def hit(self, key: str, window: int, window_seconds: int) -> Tuple[int, int]:
+        """Count a request in `window`; returns (current, previous) window counts"""
+        start, current, previous = self._windows.get(key, (window, 0, 0))
+        if start != window:
+            previous = current if start == window - 1 else 0
+            current = 0
+        current += 1
+        if key not in self._windows and len(self._windows) >= self.max_keys:
+            self._prune(window)
+        self._windows[key] = (window, current, previous)
+        return current, previous
+
+    def _prune(self, window: int):
+        # Keys idle for two windows no longer affect any decision
+        stale = [key for key, (start, _, _) in self._windows.items() if start < window - 1]
+        for key in stale:
+            del self._windows[key]
+        if len(self._windows) >= self.max_keys:
+            self._windows.clear()
+
+
+class MongoRateLimitBackend:
+    """Window counters shared by every worker through a collection with a TTL index on expires_at"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def hit(self, key: str, window: int, window_seconds: int) -> Tuple[int, int]:
+        counter = await self.collection.find_one_and_update(
+            {"_id": f"{key}:{window}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {"expires_at": datetime.utcfromtimestamp((window + 2) * window_seconds)}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await self.collection.find_one({"_id": f"{key}:{window - 1}"}, {"count": 1})
+        return counter["count"], previous["count"] if previous else 0
+
+
+class RateLimiter:
+    """Sliding-window counter: the previous fixed window is weighted by how much of it still overlaps"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryRateLimitBackend()
+        self.rejected: Dict[str, int] = {}
+
+    def set_backend(self, backend):
+        self.backend = backend
+
+    async def check(self, policy_name: str, subject: str, now: Optional[float] = None):
+        """Raise 429 with Retry-After once `subject` is over the policy's limit"""
+        policy = POLICIES[policy_name]
+        now = time.time() if now is None else now
+        window = int(now // policy.window_seconds)
+        elapsed = (now % policy.window_seconds) / policy.window_seconds
+
+        current, previous = await self.backend.hit(f"{policy.name}:{subject}", window, policy.window_seconds)
+        estimate = previous * (1 - elapsed) + current
+        if estimate <= policy.limit:
+            return
+
+        self.rejected[policy.name] = self.rejected.get(policy.name, 0) + 1
+        raise HTTPException(
+            status_code=429,
+            detail="Çok fazla istek. Lütfen daha sonra tekrar deneyin.",
+            headers={"Retry-After": str(retry_after(policy, current, previous, elapsed))}
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self.backend).__name__, "rejected": dict(self.rejected)}
+
+
+def retry_after(policy: RatePolicy, current: int, previous: int, elapsed: float) -> int:
+    """Seconds until one more request fits under the sliding estimate.
+
+    Rejected requests count too (the backends count every hit), so once `current` is past the
+    limit the next window still starts over it, weighted by `current`, until enough has slid out.
+    """
+    limit = policy.limit
+    # What the previous window may still contribute while this window lasts
+    room = limit - current - 1
+    if room >= 0:
+        wait = max(1 - elapsed - room / previous, 0) if previous else 0
+    else:
+        # Next window: current * (1 - t) + 1 <= limit
+        wait = (1 - elapsed) + max(1 - (limit - 1) / current, 0)
+    # Strictly past the boundary, where float rounding of the estimate cannot put it back over
+    return math.floor(wait * policy.window_seconds) + 1
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def limit_by_ip(policy_name: str):
+    """Runs before the endpoint body, so a rejected request costs no bcrypt or database work"""
+    async def dependency(request: Request):
+        await rate_limiter.check(policy_name, client_ip(request))
+    return dependency
+
+def limit_by_user(policy_name: str):
+    async def dependency(user_id: str = Depends(verify_token)):
+        await rate_limiter.check(policy_name, user_id)
+    return dependency
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,259 @@
+# Resumable Uploads for HayvanPazarı
+#
+# POST   /uploads                 create a session (purpose, size, filename, content_type)
+# PUT    /uploads/{id}            raw bytes appended at the Upload-Offset header
+# GET    /uploads/{id}            current offset, so an interrupted client knows where to resume
+# POST   /uploads/{id}/complete   verify and move the file into media storage
+from fastapi import HTTPException, Request
+from pathlib import Path
+from typing import Dict, Any, Optional
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+from media_storage import UPLOAD_DIR, PRIVATE_UPLOAD_DIR, media_url
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SESSION_TTL = timedelta(hours=int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24)))
+# A writer that died mid-chunk releases its claim after this long; live writers renew it
+UPLOAD_WRITER_LEASE = timedelta(seconds=120)
+UPLOAD_WRITER_RENEW = UPLOAD_WRITER_LEASE / 3
+# A completion that died mid-way (process killed while moving) is reopened after this long
+UPLOAD_FINALIZE_LEASE = timedelta(minutes=10)
+
+UPLOAD_PURPOSES = {
+    "kyc_document": {
+        "max_bytes": int(os.environ.get('MAX_KYC_DOCUMENT_BYTES', 20 * 1024 * 1024)),
+        "content_types": {"image/jpeg", "image/png", "application/pdf"},
+        "directory": "kyc",
+        "private": True
+    },
+    "listing_video": {
+        "max_bytes": int(os.environ.get('MAX_LISTING_VIDEO_BYTES', 200 * 1024 * 1024)),
+        "content_types": {"video/mp4", "video/quicktime", "video/3gpp", "video/webm"},
+        "directory": "videos",
+        "private": False
+    }
+}
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "application/pdf": ".pdf",
+    "video/mp4": ".mp4",
+    "video/quicktime": ".mov",
+    "video/3gpp": ".3gp",
+    "video/webm": ".webm"
+}
+
+
+def part_path(session_id: str) -> Path:
+    return PRIVATE_UPLOAD_DIR / "partial" / f"{session_id}.part"
+
+def session_status(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": session["_id"],
+        "purpose": session["purpose"],
+        "size": session["size"],
+        "offset": session["received"],
+        "status": session["status"],
+        "expires_at": session["expires_at"]
+    }
+
+async def create_upload_session(
+    db,
+    user_id: str,
+    purpose: str,
+    size: int,
+    content_type: str,
+    filename: Optional[str] = None,
+    target: Optional[str] = None,
+    sha256: Optional[str] = None
+) -> Dict[str, Any]:
+    rules = UPLOAD_PURPOSES.get(purpose)
+    if rules is None:
+        raise ValueError(f"Unknown upload purpose: {purpose}")
+    if content_type not in rules["content_types"]:
+        raise ValueError(f"Content type {content_type} is not allowed for {purpose}")
+    if size <= 0 or size > rules["max_bytes"]:
+        raise ValueError(f"Size must be between 1 and {rules['max_bytes']} bytes")
+
+    now = datetime.utcnow()
+    session = {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "purpose": purpose,
+        "target": target,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "sha256": sha256.lower() if sha256 else None,
+        "received": 0,
+        "status": "open",
+        "writer": None,
+        "created_at": now,
+        "expires_at": now + UPLOAD_SESSION_TTL
+    }
+    await db.upload_sessions.insert_one(session)
+    return session
+
+async def get_upload_session(db, session_id: str, user_id: str) -> Dict[str, Any]:
+    session = await db.upload_sessions.find_one({"_id": session_id, "user_id": user_id})
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+def _write_at(f, offset: int, chunk: bytes):
+    f.seek(offset)
+    f.write(chunk)
+
+async def append_chunk(db, session_id: str, user_id: str, offset: int, request: Request) -> Dict[str, Any]:
+    """Stream the request body into the part file at `offset`.
+
+    Only one writer per session: the write is claimed with a lease on the session document,
+    so a retried chunk racing the original cannot interleave bytes. The lease is renewed while
+    chunks keep arriving, and checked before each write after a pause, so a writer that stalled
+    past its lease stops instead of writing into a file another writer has taken over.
+    """
+    now = datetime.utcnow()
+    writer = uuid.uuid4().hex
+    session = await db.upload_sessions.find_one_and_update(
+        {
+            "_id": session_id,
+            "user_id": user_id,
+            "status": "open",
+            "received": offset,
+            "$or": [{"writer": None}, {"writer_expires": {"$lt": now}}]
+        },
+        {"$set": {"writer": writer, "writer_expires": now + UPLOAD_WRITER_LEASE}}
+    )
+    if session is None:
+        current = await get_upload_session(db, session_id, user_id)
+        if current["status"] != "open":
+            raise HTTPException(status_code=409, detail="Upload already completed")
+        # Client resumes from the offset we report
+        raise HTTPException(
+            status_code=409,
+            detail="Offset mismatch or another chunk is being written",
+            headers={"Upload-Offset": str(current["received"])}
+        )
+
+    path = part_path(session_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    received = offset
+    renewed_at = now
+    try:
+        with open(path, "r+b" if path.exists() else "w+b") as f:
+            # Bytes past the acknowledged offset come from a write that was never recorded
+            await loop.run_in_executor(None, f.truncate, offset)
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if received + len(chunk) > session["size"]:
+                    raise HTTPException(status_code=413, detail="Chunk exceeds the declared upload size")
+                if datetime.utcnow() - renewed_at >= UPLOAD_WRITER_RENEW:
+                    renewed_at = datetime.utcnow()
+                    renewed = await db.upload_sessions.update_one(
+                        {"_id": session_id, "writer": writer},
+                        {"$set": {"writer_expires": renewed_at + UPLOAD_WRITER_LEASE}}
+                    )
+                    if not renewed.matched_count:
+                        raise HTTPException(status_code=409, detail="Upload lease lost to another writer")
+                await loop.run_in_executor(None, _write_at, f, received, chunk)
+                received += len(chunk)
+    finally:
+        # Record what arrived even if the client dropped mid-chunk: that is what resuming is for
+        recorded = await db.upload_sessions.update_one(
+            {"_id": session_id, "writer": writer},
+            {"$set": {
+                "received": received,
+                "writer": None,
+                "updated_at": datetime.utcnow(),
+                "expires_at": datetime.utcnow() + UPLOAD_SESSION_TTL
+            }}
+        )
+        if not recorded.matched_count:
+            logger.warning("Upload chunk finished after its writer lease was lost", extra={"session_id": session_id, "offset": received})
+    return {"offset": received, "size": session["size"]}
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+async def complete_upload(db, session_id: str, user_id: str) -> Dict[str, Any]:
+    """Verify the part file and move it into storage.
+
+    Public files get a media `url`; private ones (KYC) only a `file` path relative to PRIVATE_UPLOAD_DIR.
+    """
+    # Claim the session so a repeated request cannot move the file twice
+    session = await db.upload_sessions.find_one_and_update(
+        {"_id": session_id, "user_id": user_id, "status": "open", "writer": None, "$expr": {"$eq": ["$received", "$size"]}},
+        {"$set": {"status": "finalizing", "finalizing_until": datetime.utcnow() + UPLOAD_FINALIZE_LEASE}}
+    )
+    if session is None:
+        current = await get_upload_session(db, session_id, user_id)
+        if current["status"] == "complete":
+            return current
+        raise HTTPException(
+            status_code=409,
+            detail="Upload is not complete",
+            headers={"Upload-Offset": str(current["received"])}
+        )
+
+    path = part_path(session_id)
+    loop = asyncio.get_running_loop()
+    rules = UPLOAD_PURPOSES[session["purpose"]]
+    root = PRIVATE_UPLOAD_DIR if rules["private"] else UPLOAD_DIR
+    dest = root / rules["directory"] / user_id / f"{session_id}{EXTENSIONS[session['content_type']]}"
+    # An earlier attempt that was reopened by the sweeper may already have moved the file
+    moved = not path.exists() and dest.exists()
+
+    if session.get("sha256") and not moved:
+        digest = await loop.run_in_executor(None, _sha256_file, path)
+        if digest != session["sha256"]:
+            # Corrupt bytes cannot be located; start the upload over
+            path.unlink(missing_ok=True)
+            await db.upload_sessions.update_one({"_id": session_id}, {"$set": {"received": 0, "status": "open"}})
+            raise HTTPException(status_code=422, detail="Checksum mismatch, upload restarted")
+
+    if not moved:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # A rename when both directories share a filesystem
+        await loop.run_in_executor(None, shutil.move, path, dest)
+
+    location = {"file": dest.relative_to(root).as_posix()} if rules["private"] else {"url": media_url(dest)}
+    await db.upload_sessions.update_one(
+        {"_id": session_id},
+        {"$set": {"status": "complete", "completed_at": datetime.utcnow(), **location}}
+    )
+    session.update({"status": "complete", **location})
+    return session
+
+async def expire_upload_sessions(db) -> int:
+    """Reopen completions that died mid-way, then remove abandoned sessions and their partial files"""
+    reopened = await db.upload_sessions.update_many(
+        {"status": "finalizing", "finalizing_until": {"$lt": datetime.utcnow()}},
+        {"$set": {"status": "open", "expires_at": datetime.utcnow() + UPLOAD_SESSION_TTL}}
+    )
+    if reopened.modified_count:
+        logger.warning("Reopened stalled upload completions", extra={"reopened": reopened.modified_count})
+
+    expired = 0
+    async for session in db.upload_sessions.find(
+        {"status": "open", "expires_at": {"$lt": datetime.utcnow()}},
+        {"_id": 1}
+    ):
+        part_path(session["_id"]).unlink(missing_ok=True)
+        await db.upload_sessions.delete_one({"_id": session["_id"], "status": "open"})
+        expired += 1
+    if expired:
+        logger.info("Expired abandoned upload sessions", extra={"expired": expired})
+    return expired
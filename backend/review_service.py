@@ -0,0 +1,141 @@
+# Seller Reviews for HayvanPazarı
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+import uuid
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from auth_context import invalidate_current_user
+from ttl_cache import TTLCache
+
+# Everything the public seller profile shows; rating fields are maintained on every review write
+SELLER_PROFILE_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "first_name": 1,
+    "last_name": 1,
+    "profile_image": 1,
+    "user_type": 1,
+    "location.city": 1,
+    "is_verified": 1,
+    "kyc_status": 1,
+    "rating": 1,
+    "total_reviews": 1,
+    "created_at": 1
+}
+seller_profiles = TTLCache(maxsize=5000, ttl_seconds=120)
+
+
+def _rating_update(rating_delta: int, count_delta: int) -> List[Dict[str, Any]]:
+    """Pipeline that moves the running sum/count and recomputes the average in one atomic write.
+
+    Users from before reviews existed have no rating_sum; it is seeded from rating × total_reviews.
+    """
+    return [
+        {"$set": {
+            "rating_sum": {"$add": [
+                {"$ifNull": ["$rating_sum", {"$multiply": [{"$ifNull": ["$rating", 0]}, {"$ifNull": ["$total_reviews", 0]}]}]},
+                rating_delta
+            ]},
+            "total_reviews": {"$add": [{"$ifNull": ["$total_reviews", 0]}, count_delta]}
+        }},
+        {"$set": {
+            "rating": {"$cond": [
+                {"$gt": ["$total_reviews", 0]},
+                {"$round": [{"$divide": ["$rating_sum", "$total_reviews"]}, 2]},
+                0.0
+            ]}
+        }}
+    ]
+
+async def has_dealt_with(db, reviewer_id: str, seller_id: str, listing_id: str) -> bool:
+    """Only buyers who contacted the seller about one of the seller's own listings may review them"""
+    listing_keys = [{"_id": listing_id}, {"id": listing_id}]
+    if ObjectId.is_valid(listing_id):
+        listing_keys.append({"_id": ObjectId(listing_id)})
+    listing = await db.listings.find_one({"seller_id": seller_id, "$or": listing_keys}, {"_id": 1})
+    if listing is None:
+        return False
+    message = await db.messages.find_one(
+        {"sender_id": reviewer_id, "receiver_id": seller_id, "listing_id": listing_id},
+        {"_id": 1}
+    )
+    return message is not None
+
+async def create_review(
+    db,
+    reviewer_id: str,
+    seller_id: str,
+    listing_id: str,
+    rating: int,
+    comment: Optional[str] = None
+) -> Dict[str, Any]:
+    if reviewer_id == seller_id:
+        raise ValueError("Kendinizi değerlendiremezsiniz")
+    if not await has_dealt_with(db, reviewer_id, seller_id, listing_id):
+        raise ValueError("Sadece iletişime geçtiğiniz satıcıları değerlendirebilirsiniz")
+
+    review = {
+        "_id": str(uuid.uuid4()),
+        "seller_id": seller_id,
+        "reviewer_id": reviewer_id,
+        "listing_id": listing_id,
+        "rating": rating,
+        "comment": comment,
+        "created_at": datetime.utcnow()
+    }
+    try:
+        await db.reviews.insert_one(review)
+    except DuplicateKeyError:
+        raise ValueError("Bu ilan için zaten değerlendirme yaptınız")
+
+    await db.users.update_one({"id": seller_id}, _rating_update(rating, 1))
+    invalidate_seller_profile(seller_id)
+    return review
+
+async def delete_review(db, review_id: str, reviewer_id: str) -> Optional[Dict[str, Any]]:
+    """Remove the reviewer's own review and take it back out of the seller's aggregate"""
+    review = await db.reviews.find_one_and_delete({"_id": review_id, "reviewer_id": reviewer_id})
+    if review is None:
+        return None
+    await db.users.update_one({"id": review["seller_id"]}, _rating_update(-review["rating"], -1))
+    invalidate_seller_profile(review["seller_id"])
+    return review
+
+async def get_seller_profile(db, seller_id: str) -> Optional[Dict[str, Any]]:
+    """Public profile: a single projected read of precomputed fields, cached briefly"""
+    profile = seller_profiles.get(seller_id)
+    if profile is None:
+        user = await db.users.find_one({"id": seller_id}, SELLER_PROFILE_PROJECTION)
+        if user is None:
+            return None
+        profile = {
+            "id": user["id"],
+            "name": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
+            "profile_image": user.get("profile_image"),
+            "user_type": user.get("user_type"),
+            "city": (user.get("location") or {}).get("city"),
+            "is_verified": user.get("is_verified", False) or user.get("kyc_status") == "verified",
+            "rating": user.get("rating", 0.0),
+            "total_reviews": user.get("total_reviews", 0),
+            "member_since": user.get("created_at")
+        }
+        seller_profiles.set(seller_id, profile)
+    return profile
+
+def invalidate_seller_profile(user_id: str):
+    """Rating fields live on the user document, so /auth/me's cached copy goes too"""
+    seller_profiles.pop(user_id)
+    invalidate_current_user(user_id)
+
+async def get_seller_reviews(
+    db,
+    seller_id: str,
+    limit: int = 20,
+    before: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    query: Dict[str, Any] = {"seller_id": seller_id}
+    if before:
+        query["created_at"] = {"$lt": before}
+    return await db.reviews.find(query).sort("created_at", -1).limit(limit).to_list(limit)
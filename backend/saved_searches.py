@@ -0,0 +1,116 @@
+# Saved Searches for HayvanPazarı
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+import logging
+import uuid
+
+from job_queue import idempotent
+from message_search import fold_turkish
+from notification_service import NotificationType, NotificationPriority, create_notifications_bulk
+
+logger = logging.getLogger(__name__)
+
+MAX_SAVED_SEARCHES_PER_USER = 20
+
+# Most selective predicate first: a saved search is indexed under exactly one of these
+ANCHOR_FIELDS = ("breed", "city", "category")
+
+
+def normalize(value: str) -> str:
+    return fold_turkish(value.strip())
+
+def anchor_for(filters: Dict[str, Any]) -> str:
+    """Inverted-index key for a saved search: its most selective equality predicate"""
+    for field in ANCHOR_FIELDS:
+        if filters.get(field):
+            return f"{field}:{normalize(filters[field])}"
+    return "*"
+
+def listing_keys(listing: Dict[str, Any]) -> List[str]:
+    """Every anchor a listing can satisfy, so candidate lookup is a single $in"""
+    details = listing.get("animal_details") or {}
+    location = listing.get("location") or {}
+    keys = ["*"]
+    if details.get("breed"):
+        keys.append(f"breed:{normalize(details['breed'])}")
+    if location.get("city"):
+        keys.append(f"city:{normalize(location['city'])}")
+    if listing.get("category"):
+        keys.append(f"category:{normalize(listing['category'])}")
+    return keys
+
+def _same(expected: Optional[str], actual: Optional[str]) -> bool:
+    return expected is None or (actual is not None and normalize(expected) == normalize(actual))
+
+def matches(filters: Dict[str, Any], listing: Dict[str, Any]) -> bool:
+    """Evaluate the full SearchFilters predicate against a listing"""
+    details = listing.get("animal_details") or {}
+    location = listing.get("location") or {}
+    price = listing.get("price")
+    age = details.get("age_months")
+
+    if not _same(filters.get("category"), listing.get("category")):
+        return False
+    if not _same(filters.get("city"), location.get("city")):
+        return False
+    if not _same(filters.get("district"), location.get("district")):
+        return False
+    if not _same(filters.get("breed"), details.get("breed")):
+        return False
+    if not _same(filters.get("gender"), details.get("gender")):
+        return False
+    if not _same(filters.get("purpose"), details.get("purpose")):
+        return False
+    if filters.get("min_price") is not None and (price is None or price < filters["min_price"]):
+        return False
+    if filters.get("max_price") is not None and (price is None or price > filters["max_price"]):
+        return False
+    if filters.get("min_age_months") is not None and (age is None or age < filters["min_age_months"]):
+        return False
+    if filters.get("max_age_months") is not None and (age is None or age > filters["max_age_months"]):
+        return False
+    return True
+
+async def create_saved_search(db, user_id: str, filters: Dict[str, Any], name: Optional[str] = None) -> Dict[str, Any]:
+    saved_search = {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "name": name,
+        "filters": filters,
+        "anchor": anchor_for(filters),
+        "created_at": datetime.utcnow()
+    }
+    await db.saved_searches.insert_one(saved_search)
+    return saved_search
+
+async def find_matching_users(db, listing: Dict[str, Any]) -> List[str]:
+    """Users with a saved search matching the listing; only anchor-indexed candidates are evaluated"""
+    user_ids = set()
+    candidates = 0
+    async for saved_search in db.saved_searches.find(
+        {"anchor": {"$in": listing_keys(listing)}},
+        {"user_id": 1, "filters": 1}
+    ):
+        candidates += 1
+        if saved_search["user_id"] != listing.get("seller_id") and matches(saved_search["filters"], listing):
+            user_ids.add(saved_search["user_id"])
+    logger.debug("Saved search matching", extra={"candidates": candidates, "matched": len(user_ids)})
+    return list(user_ids)
+
+@idempotent
+async def notify_saved_search_matches(db, listing: Dict[str, Any]):
+    """Runs after create_listing commits; hands every match to the bulk notification fan-out"""
+    user_ids = await find_matching_users(db, listing)
+    if not user_ids:
+        return
+    listing_id = str(listing.get("_id") or listing.get("id"))
+    await create_notifications_bulk(
+        db,
+        user_ids,
+        notification_type=NotificationType.LISTING,
+        priority=NotificationPriority.MEDIUM,
+        title="Aramanıza Uygun Yeni İlan",
+        message=f"'{listing.get('title', 'İlan')}' kayıtlı aramanızla eşleşti",
+        data={"listing_id": listing_id},
+        dedupe_key=f"saved_search:{listing_id}"
+    )
@@ -1,7 +1,29 @@
 from animal_breeds_data import ANIMAL_BREEDS
-from notification_service import NotificationType, NotificationPriority, NotificationStatus, create_notification
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from notification_service import NotificationType, NotificationPriority, NotificationStatus, create_notification, get_user_notification_settings, invalidate_notification_settings, release_deferred_notifications
+from notification_scheduler import delivery_scheduler
+from notification_outbox import outbox_dispatcher
+from notification_counters import adjust_unread_notifications, get_unread_notification_count, reconcile_unread_notifications
+from saved_searches import MAX_SAVED_SEARCHES_PER_USER, create_saved_search, notify_saved_search_matches
+from notification_retention import ensure_retention_indexes, archive_notifications, find_archived_notifications, delete_archived_notifications
+from notification_stream import notification_streams, format_event, notification_payload, event_id_for, parse_event_id, HEARTBEAT_SECONDS, RETRY_MILLISECONDS, REPLAY_LIMIT
+from message_counters import increment_unread, decrement_unread, get_unread_total, get_unread_by_peer, reconcile_unread_counters
+from offer_service import OfferStatus, create_offer, transition_offer, get_listing_offers, expire_offers
+from job_queue import JobQueue, idempotent
+from password_hashing import password_hasher, PasswordHasherBusy, needs_rehash
+from user_cache import user_summaries
+from message_search import index_message, search_messages, backfill_message_search, remove_from_search
+from rate_limit import rate_limiter, limit_by_ip, limit_by_user, client_ip, MongoRateLimitBackend, TRUST_FORWARDED_FOR
+from media_storage import UPLOAD_DIR, MEDIA_URL_PREFIX, MAX_PROFILE_IMAGE_BYTES, MULTIPART_OVERHEAD_BYTES, image_executor, store_profile_image, delete_media, BodySizeLimitMiddleware
+from resumable_uploads import create_upload_session, get_upload_session, append_chunk, complete_upload, session_status, expire_upload_sessions
+from review_service import create_review, delete_review, get_seller_profile, get_seller_reviews, invalidate_seller_profile
+from logging_setup import setup_logging, stop_logging, dropped_log_records, RequestIdMiddleware
+from metrics import metrics_registry, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from db_instrumentation import command_listener, QueryStatsMiddleware
+from auth_context import create_access_token, verify_token, token_claims, security, load_current_user, invalidate_current_user, revoke_token, load_revocations
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Header, Request
+from fastapi.responses import StreamingResponse, Response
+from fastapi.staticfiles import StaticFiles
+from fastapi.security import HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -9,12 +31,12 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 import uuid
-from datetime import datetime, timedelta
-import jwt
-import bcrypt
+from datetime import datetime
 import base64
+import hmac
+import ipaddress
 from bson import ObjectId
 import pymongo
 import asyncio
@@ -23,11 +45,19 @@ from enum import Enum
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Every command is timed and attributed to the request that issued it
+client = AsyncIOMotorClient(mongo_url, event_listeners=[command_listener])
 db = client[os.environ['DB_NAME']]
 
+# Share rate limit counters between workers when running more than one
+if os.environ.get('RATE_LIMIT_BACKEND') == 'mongo':
+    rate_limiter.set_backend(MongoRateLimitBackend(db.rate_limits))
+
 # Create indexes
 async def create_indexes():
     # Users indexes
@@ -45,16 +75,69 @@ async def create_indexes():
     # Messages indexes
     await db.messages.create_index([("sender_id", 1), ("receiver_id", 1)])
     await db.messages.create_index("created_at")
+    await db.messages.create_index([("receiver_id", 1), ("is_read", 1)])
+    
+    # Message search index: owner prefix keeps each user's lookups in their own range
+    await db.message_search.create_index(
+        [("owner_id", 1), ("text", pymongo.TEXT)],
+        name="owner_text",
+        default_language="turkish"
+    )
+    await db.message_search.create_index("message_id")
+    
+    # Unread counter indexes
+    await db.conversation_counters.create_index("user_id")
     
     # Notifications indexes
     await db.notifications.create_index("user_id")
-    await db.notifications.create_index("status")
+    await db.notifications.create_index([("status", 1), ("created_at", 1)])
     await db.notifications.create_index("priority")
     await db.notifications.create_index("created_at")
-    await db.notifications.create_index([("user_id", 1), ("status", 1)])
+    await db.notifications.create_index([("user_id", 1), ("status", 1), ("created_at", -1)])
+    await db.notifications.create_index([("user_id", 1), ("created_at", 1), ("_id", 1)])
+    await db.notifications.create_index([("user_id", 1), ("updated_at", 1), ("_id", 1)])
+    await db.notifications.create_index(
+        [("delivery_status", 1), ("deliver_at", 1)],
+        partialFilterExpression={"delivery_status": "deferred"}
+    )
+    # Delivery outbox: only notifications with pending deliveries are indexed
+    await db.notifications.create_index("outbox.push.next_at", sparse=True)
+    await db.notifications.create_index("outbox.email.next_at", sparse=True)
+    await db.notifications.create_index("outbox.push.claim", sparse=True)
+    await db.notifications.create_index("outbox.email.claim", sparse=True)
+    # At most one notification per coalesce key is open to absorb a burst
+    await db.notifications.create_index(
+        "coalesce_key",
+        unique=True,
+        partialFilterExpression={"coalesce_open": True}
+    )
+    await ensure_retention_indexes(db)
+    
+    # Offers indexes
+    await db.offers.create_index([("listing_key", 1), ("status", 1), ("amount", -1)])
+    await db.offers.create_index([("status", 1), ("expires_at", 1)])
+    await db.offers.create_index("buyer_id")
+    
+    # Saved searches indexes
+    await db.saved_searches.create_index("anchor")
+    await db.saved_searches.create_index("user_id")
+    
+    # Upload sessions: abandoned ones are swept with their partial files, finished ones just expire
+    await db.upload_sessions.create_index([("status", 1), ("expires_at", 1)])
+    await db.upload_sessions.create_index("completed_at", expireAfterSeconds=7 * 24 * 3600)
+    
+    # Reviews indexes: one review per buyer per listing
+    await db.reviews.create_index([("reviewer_id", 1), ("seller_id", 1), ("listing_id", 1)], unique=True)
+    await db.reviews.create_index([("seller_id", 1), ("created_at", -1)])
     
     # Notification Settings indexes
     await db.notification_settings.create_index("user_id", unique=True)
+    
+    # Revoked tokens are only kept until they would have expired anyway
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    
+    # Shared rate limit windows clean themselves up
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
 
 app = FastAPI(title="HayvanPazarı API", version="1.0.0")
 
@@ -66,40 +149,61 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route request counts and latency histograms, served on /metrics
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+# Mongo commands per request, slow command and N+1 logging
+app.add_middleware(QueryStatsMiddleware)
+# Multipart uploads are parsed before the endpoint runs, so their size is capped while receiving
+app.add_middleware(BodySizeLimitMiddleware, limits={
+    "/api/users/profile/image": MAX_PROFILE_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES
+})
+# Request ids for log correlation; added last so it is outermost and the request id is still set
+# when the middlewares above log in their finally blocks (N+1 warnings, slow commands)
+app.add_middleware(RequestIdMiddleware)
 
 api_router = APIRouter(prefix="/api")
-security = HTTPBearer()
 
-# JWT Configuration
-JWT_SECRET = "hayvan-pazari-secret-key-2025"
-JWT_ALGORITHM = "HS256"
-JWT_EXPIRATION_TIME = timedelta(days=7)
+# Notification work runs off the request path
+notification_jobs = JobQueue(
+    "notifications",
+    maxsize=int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 1000)),
+    workers=int(os.environ.get('NOTIFICATION_WORKERS', 4))
+)
 
 # Helper Functions
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + JWT_EXPIRATION_TIME
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    return encoded_jwt
-
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def current_user(user_id: str = Depends(verify_token)) -> Dict[str, Any]:
+    user = await load_current_user(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+def invalidate_user_caches(user_id: str):
+    """Call after any write to a user's document"""
+    user_summaries.invalidate(user_id)
+    invalidate_current_user(user_id)
+    invalidate_seller_profile(user_id)
+
+async def find_listing(listing_id: str) -> Optional[Dict[str, Any]]:
+    """Find a listing by UUID _id, id field or ObjectId hex string"""
+    listing = await db.listings.find_one({"_id": listing_id})
+    if not listing:
+        listing = await db.listings.find_one({"id": listing_id})
+    if not listing and ObjectId.is_valid(listing_id):
+        listing = await db.listings.find_one({"_id": ObjectId(listing_id)})
+    return listing
+
+# bcrypt runs on password_hasher's thread pool, never on the event loop
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
+async def verify_password(password: str, hashed: str) -> bool:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        return await password_hasher.verify(password, hashed)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
 # Models
 class UserType(str):
@@ -211,6 +315,8 @@ class Listing(BaseModel):
     views: int = 0
     favorites: int = 0
     is_featured: bool = False
+    best_offer: Optional[Dict[str, Any]] = None
+    open_offers: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -292,6 +398,7 @@ class NotificationSettings(BaseModel):
     quiet_hours_enabled: bool = False
     quiet_hours_start: str = "22:00"  # 22:00
     quiet_hours_end: str = "08:00"    # 08:00
+    timezone: str = "Europe/Istanbul"  # IANA name, quiet hours are in this zone
     notification_types: Dict[str, bool] = {
         "messages": True,
         "offers": True,
@@ -316,6 +423,23 @@ class SearchFilters(BaseModel):
     gender: Optional[str] = None
     purpose: Optional[str] = None
 
+class SavedSearchCreate(BaseModel):
+    name: Optional[str] = None
+    filters: SearchFilters
+
+class ReviewCreate(BaseModel):
+    listing_id: str
+    rating: int = Field(..., ge=1, le=5)
+    comment: Optional[str] = Field(None, max_length=1000)
+
+class UploadSessionCreate(BaseModel):
+    purpose: str  # kyc_document, listing_video
+    size: int
+    content_type: str
+    filename: Optional[str] = None
+    target: str  # KYC document type (e.g. id_front) or listing id
+    sha256: Optional[str] = None
+
 # Categories Data
 ANIMAL_CATEGORIES = [
     {
@@ -375,19 +499,21 @@ async def get_categories():
             "breeds": category_data["breeds"]
         })
     
-    print(f"📂 Categories loaded: {len(categories)} categories, total breeds: {sum(len(cat['breeds']) for cat in categories)}")
+    logger.debug("Categories loaded", extra={"categories": len(categories)})
     return categories
 
 # Authentication Routes
-@api_router.post("/auth/register")
+@api_router.post("/auth/register", dependencies=[Depends(limit_by_ip("register_ip"))])
 async def register(user_data: UserCreate):
+    # The tight limit is per phone number; the per-IP one only stops bulk sign-ups
+    await rate_limiter.check("register_phone", user_data.phone)
     # Check if user exists
     existing_user = await db.users.find_one({"$or": [{"email": user_data.email}, {"phone": user_data.phone}]})
     if existing_user:
         raise HTTPException(status_code=400, detail="User already exists")
     
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     
     # Create user
     user_dict = user_data.dict()
@@ -420,12 +546,25 @@ async def register(user_data: UserCreate):
         }
     }
 
-@api_router.post("/auth/login")
+@api_router.post("/auth/login", dependencies=[Depends(limit_by_ip("login_ip"))])
 async def login(login_data: UserLogin):
+    # Also per account, so a botnet cannot spread guesses for one email across IPs
+    await rate_limiter.check("login_email", login_data.email.lower())
     user = await db.users.find_one({"email": login_data.email})
-    if not user or not verify_password(login_data.password, user["password"]):
+    if not user or not await verify_password(login_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Cost factor changed since this hash was made: upgrade it while we have the plain password.
+    # Best effort only: the password is already verified, so a busy hasher or failed write must not fail the login
+    if needs_rehash(user["password"]):
+        try:
+            await db.users.update_one(
+                {"id": user["id"], "password": user["password"]},
+                {"$set": {"password": await hash_password(login_data.password), "updated_at": datetime.utcnow()}}
+            )
+        except Exception:
+            logger.warning("Password rehash on login failed", exc_info=True, extra={"user_id": user["id"]})
+    
     access_token = create_access_token({"user_id": user["id"]})
     
     return {
@@ -453,20 +592,22 @@ async def verify_sms(verification: SMSVerification, user_id: str = Depends(verif
         {"id": user_id},
         {"$set": {"is_phone_verified": True, "updated_at": datetime.utcnow()}}
     )
+    invalidate_user_caches(user_id)
     
     return {"message": "Phone verified successfully"}
 
 @api_router.get("/auth/me")
-async def get_current_user(user_id: str = Depends(verify_token)):
-    user = await db.users.find_one({"id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Remove password and MongoDB _id from response
-    user.pop("password", None)
-    user.pop("_id", None)
+async def get_current_user(user: Dict[str, Any] = Depends(current_user)):
     return user
 
+@api_router.post("/auth/logout")
+async def logout(
+    claims: Dict[str, Any] = Depends(token_claims),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    await revoke_token(db, claims, credentials.credentials)
+    return {"message": "Logged out"}
+
 # User Profile Routes
 @api_router.put("/users/profile")
 async def update_profile(
@@ -476,32 +617,47 @@ async def update_profile(
     city: Optional[str] = Form(None),
     district: Optional[str] = Form(None),
     profile_image: Optional[str] = Form(None),
-    user_id: str = Depends(verify_token)
+    user: Dict[str, Any] = Depends(current_user)
 ):
+    user_id = user["id"]
+    # Pipeline update: user input goes through $literal so "$..." values are never read as field paths
     update_data = {"updated_at": datetime.utcnow()}
     
     if first_name:
-        update_data["first_name"] = first_name
+        update_data["first_name"] = {"$literal": first_name}
     if last_name:
-        update_data["last_name"] = last_name
+        update_data["last_name"] = {"$literal": last_name}
     if user_type:
-        update_data["user_type"] = user_type
+        update_data["user_type"] = {"$literal": user_type}
     if city or district:
-        # Get current user to preserve existing location data
-        current_user = await db.users.find_one({"id": user_id})
-        current_location = current_user.get("location", {}) if current_user else {}
-        
-        location = {
-            "city": city if city else current_location.get("city", ""),
-            "district": district if district else current_location.get("district", "")
+        # Fields not sent keep their stored value, resolved by the server in the same write
+        update_data["location"] = {
+            "city": {"$literal": city} if city else {"$ifNull": ["$location.city", ""]},
+            "district": {"$literal": district} if district else {"$ifNull": ["$location.district", ""]}
         }
-        update_data["location"] = location
     if profile_image:
-        update_data["profile_image"] = profile_image
+        # Legacy base64 clients; new clients use POST /users/profile/image
+        update_data["profile_image"] = {"$literal": profile_image}
     
-    await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await db.users.update_one({"id": user_id}, [{"$set": update_data}])
+    if profile_image:
+        delete_media(user.get("profile_image"))
+    invalidate_user_caches(user_id)
     return {"message": "Profile updated successfully"}
 
+@api_router.post("/users/profile/image")
+async def upload_profile_image(image: UploadFile = File(...), user: Dict[str, Any] = Depends(current_user)):
+    url = await store_profile_image(image, user["id"])
+    previous = await db.users.find_one_and_update(
+        {"id": user["id"]},
+        {"$set": {"profile_image": url, "updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "profile_image": 1}
+    )
+    if previous:
+        delete_media(previous.get("profile_image"))
+    invalidate_user_caches(user["id"])
+    return {"profile_image": url}
+
 # Listing Routes
 @api_router.post("/listings", response_model=Listing)
 async def create_listing(listing_data: ListingCreate, user_id: str = Depends(verify_token)):
@@ -512,6 +668,8 @@ async def create_listing(listing_data: ListingCreate, user_id: str = Depends(ver
     listing_dict["updated_at"] = datetime.utcnow()
     
     result = await db.listings.insert_one(listing_dict)
+    # Tell buyers whose saved searches match, off the request path
+    await notification_jobs.submit(notify_saved_search_matches, db, dict(listing_dict))
     # Remove MongoDB's _id field to avoid conflicts
     listing_dict.pop("_id", None)
     return Listing(**listing_dict)
@@ -546,12 +704,8 @@ async def get_listings(
     if search:
         query["$text"] = {"$search": search}
     
-    print(f"📋 Listings query: {query}")  # Debug log
     listings = await db.listings.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    print(f"📋 Found {len(listings)} listings")  # Debug log
-    
-    if listings:
-        print(f"📋 First listing status: {listings[0].get('status')}")  # Debug status field
+    logger.debug("Listings query", extra={"query": query, "found": len(listings)})
     
     # Set id field from _id for frontend compatibility
     for listing in listings:
@@ -561,37 +715,13 @@ async def get_listings(
 
 @api_router.get("/listings/{listing_id}", response_model=Listing)
 async def get_listing(listing_id: str):
-    print(f"🔍 Looking for listing with ID: {listing_id}")
-    
-    # Try to find by multiple ID formats
-    listing = None
+    # UUID _id, id field, then ObjectId hex (the id this endpoint hands out) — each an indexed lookup
+    listing = await find_listing(listing_id)
     
-    # Try 1: Direct _id match (UUID format)
-    listing = await db.listings.find_one({"_id": listing_id})
-    if listing:
-        print(f"✅ Found by _id (UUID): {listing_id}")
-    
-    # Try 2: Search by id field (may be hex)
     if not listing:
-        listing = await db.listings.find_one({"id": listing_id})
-        if listing:
-            print(f"✅ Found by id field: {listing_id}")
-    
-    # Try 3: Search all listings where str(_id) matches (hex conversion)
-    if not listing:
-        all_listings = await db.listings.find({}).to_list(None)
-        for l in all_listings:
-            if str(l["_id"]) == listing_id:
-                listing = l
-                print(f"✅ Found by hex conversion: {listing_id} -> {l['_id']}")
-                break
-    
-    if not listing:
-        print(f"❌ Listing not found with any ID format: {listing_id}")
+        logger.debug("Listing not found", extra={"listing_id": listing_id})
         raise HTTPException(status_code=404, detail="Listing not found")
     
-    print(f"✅ Listing found: {listing.get('title', 'No title')}")
-    
     # Increment view count using original _id
     original_id = listing["_id"]
     await db.listings.update_one({"_id": original_id}, {"$inc": {"views": 1}})
@@ -653,52 +783,72 @@ async def get_user_listings(user_id: str, current_user_id: str = Depends(verify_
     return [Listing(**listing) for listing in listings]
 
 # Messages Routes
-@api_router.post("/messages", response_model=Message)
+@api_router.post("/messages", response_model=Message, dependencies=[Depends(limit_by_user("send_message_user"))])
 async def send_message(message_data: MessageCreate, user_id: str = Depends(verify_token)):
     message_dict = message_data.dict()
     message_dict["id"] = str(uuid.uuid4())
     message_dict["sender_id"] = user_id
+    message_dict["is_read"] = False
     message_dict["created_at"] = datetime.utcnow()
     
     result = await db.messages.insert_one(message_dict)
     # Remove MongoDB _id field to avoid conflicts  
     message_dict.pop("_id", None)
     
-    # Create notification for receiver
-    receiver_id = message_data.receiver_id
-    sender = await db.users.find_one({"_id": user_id})
-    sender_name = f"{sender['first_name']} {sender['last_name']}" if sender else "Bilinmeyen Kullanıcı"
+    await increment_unread(db, message_data.receiver_id, user_id, message_data.listing_id)
+    await index_message(db, message_dict)
+    
+    listing = None
+    if message_data.message_type == "offer" and message_data.offer_amount:
+        listing = await find_listing(message_data.listing_id)
+        if listing:
+            await create_offer(db, listing, user_id, message_data.offer_amount, message_id=message_dict["id"])
+    
+    # Notify the receiver in the background so the sender only waits for the insert
+    await notification_jobs.submit(notify_message_receiver, message_dict, listing)
+    
+    # Ensure the response follows the expected Message model
+    return Message(**message_dict)
+
+@idempotent
+async def notify_message_receiver(message_dict: Dict[str, Any], listing: Optional[Dict[str, Any]] = None):
+    """Create the new message/offer notification for the receiver (runs on notification_jobs)"""
+    user_id = message_dict["sender_id"]
+    receiver_id = message_dict["receiver_id"]
+    sender = await user_summaries.get(db, user_id)
+    sender_name = sender["name"] if sender else "Bilinmeyen Kullanıcı"
     
     # Get listing info for context
-    listing = await db.listings.find_one({"_id": message_data.listing_id})
+    if listing is None:
+        listing = await find_listing(message_dict["listing_id"])
     listing_title = listing["title"] if listing else "İlan"
     
-    if message_data.message_type == "offer":
+    if message_dict["message_type"] == "offer":
         title = "Yeni Teklif"
-        message = f"{sender_name} '{listing_title}' ilanınız için {message_data.offer_amount:,.0f} TL teklif verdi"
+        message = f"{sender_name} '{listing_title}' ilanınız için {message_dict['offer_amount'] or 0:,.0f} TL teklif verdi"
         priority = NotificationPriority.HIGH
+        notification_type = NotificationType.OFFER
     else:
         title = "Yeni Mesaj"
         message = f"{sender_name} '{listing_title}' ilanınız hakkında mesaj gönderdi"
         priority = NotificationPriority.HIGH
+        notification_type = NotificationType.MESSAGE
     
     await create_notification(
         db=db,
         user_id=receiver_id,
-        notification_type=NotificationType.MESSAGE,
+        notification_type=notification_type,
         priority=priority,
         title=title,
         message=message,
         data={
             "message_id": message_dict["id"],
-            "listing_id": message_data.listing_id,
+            "listing_id": message_dict["listing_id"],
             "sender_id": user_id,
             "sender_name": sender_name
-        }
+        },
+        dedupe_key=f"message:{message_dict['id']}"
     )
-    
-    # Ensure the response follows the expected Message model
-    return Message(**message_dict)
 
 @api_router.get("/messages/conversations")
 async def get_conversations(user_id: str = Depends(verify_token)):
@@ -715,29 +865,30 @@ async def get_conversations(user_id: str = Depends(verify_token)):
                         "$sender_id"
                     ]
                 },
-                "last_message": {"$first": "$$ROOT"},
-                "unread_count": {
-                    "$sum": {
-                        "$cond": [
-                            {"$and": [{"$eq": ["$receiver_id", user_id]}, {"$eq": ["$is_read", False]}]},
-                            1,
-                            0
-                        ]
-                    }
-                }
+                "last_message": {"$first": "$$ROOT"}
             }
         }
     ]
     
     conversations = await db.messages.aggregate(pipeline).to_list(100)
+    # Unread badges come from the maintained counters instead of scanning messages
+    unread_by_peer = await get_unread_by_peer(db, user_id)
+    other_users = await user_summaries.get_many(db, [conv["_id"] for conv in conversations])
+    listing_ids = list({conv["last_message"]["listing_id"] for conv in conversations})
+    listings = {
+        listing["id"]: listing
+        async for listing in db.listings.find({"id": {"$in": listing_ids}}, {"id": 1, "title": 1, "price": 1, "images": {"$slice": 1}})
+    } if listing_ids else {}
     
     # Get user details for each conversation and clean up ObjectIds
     for conv in conversations:
+        conv["unread_count"] = unread_by_peer.get(conv["_id"], 0)
+        
         # Clean up ObjectIds from the conversation data
         if "last_message" in conv and "_id" in conv["last_message"]:
             conv["last_message"].pop("_id", None)
         
-        other_user = await db.users.find_one({"id": conv["_id"]})
+        other_user = other_users.get(conv["_id"])
         if other_user:
             conv["other_user"] = {
                 "id": other_user["id"],
@@ -747,7 +898,7 @@ async def get_conversations(user_id: str = Depends(verify_token)):
             }
         
         # Get listing details
-        listing = await db.listings.find_one({"id": conv["last_message"]["listing_id"]})
+        listing = listings.get(conv["last_message"]["listing_id"])
         if listing:
             conv["listing"] = {
                 "id": listing["id"],
@@ -758,6 +909,24 @@ async def get_conversations(user_id: str = Depends(verify_token)):
     
     return conversations
 
+@api_router.get("/messages/unread-count")
+async def get_unread_message_count(user_id: str = Depends(verify_token)):
+    """Get total unread message count for the inbox badge"""
+    return {"unread_count": await get_unread_total(db, user_id)}
+
+@api_router.get("/messages/search")
+async def search_my_messages(
+    q: str,
+    limit: int = 20,
+    skip: int = 0,
+    user_id: str = Depends(verify_token)
+):
+    """Full-text search within the caller's own conversations"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is required")
+    limit = max(1, min(limit, 50))
+    return await search_messages(db, user_id, q, limit=limit, skip=max(skip, 0))
+
 @api_router.get("/messages/{other_user_id}/{listing_id}")
 async def get_messages(other_user_id: str, listing_id: str, user_id: str = Depends(verify_token)):
     messages = await db.messages.find({
@@ -773,10 +942,11 @@ async def get_messages(other_user_id: str, listing_id: str, user_id: str = Depen
     }).sort("created_at", 1).to_list(1000)
     
     # Mark messages as read
-    await db.messages.update_many(
-        {"sender_id": other_user_id, "receiver_id": user_id, "listing_id": listing_id},
+    result = await db.messages.update_many(
+        {"sender_id": other_user_id, "receiver_id": user_id, "listing_id": listing_id, "is_read": {"$ne": True}},
         {"$set": {"is_read": True}}
     )
+    await decrement_unread(db, user_id, other_user_id, listing_id, result.modified_count)
     
     # Remove MongoDB _id field from each message
     for message in messages:
@@ -805,13 +975,13 @@ async def delete_listing(listing_id: str, user_id: str = Depends(verify_token)):
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Listing not found")
         
-        print(f"🗑️ Deleted listing {listing_id}")
+        logger.info("Deleted listing", extra={"listing_id": listing_id, "user_id": user_id})
         return {"status": "success", "message": "Listing deleted"}
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"❌ Error deleting listing: {e}")
+    except Exception:
+        logger.exception("Error deleting listing", extra={"listing_id": listing_id})
         raise HTTPException(status_code=500, detail="Failed to delete listing")
 
 @api_router.put("/listings/{listing_id}")
@@ -867,15 +1037,223 @@ async def update_listing(
         updated_listing["id"] = str(updated_listing["_id"])
         updated_listing.pop("_id", None)
         
-        print(f"✏️ Updated listing {listing_id}")
+        logger.info("Updated listing", extra={"listing_id": listing_id, "user_id": user_id})
         return updated_listing
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"❌ Error updating listing: {e}")
+    except Exception:
+        logger.exception("Error updating listing", extra={"listing_id": listing_id})
         raise HTTPException(status_code=500, detail="Failed to update listing")
 
+# Resumable Upload Routes
+KYC_DOCUMENT_TYPES = {"id_front", "id_back", "selfie", "farm_registration", "tax_certificate"}
+
+async def owned_listing(listing_id: str, user_id: str) -> Dict[str, Any]:
+    listing = await find_listing(listing_id)
+    if not listing:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    if listing["seller_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return listing
+
+@api_router.post("/uploads")
+async def create_upload(upload_data: UploadSessionCreate, user_id: str = Depends(verify_token)):
+    if upload_data.purpose == "kyc_document" and upload_data.target not in KYC_DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid KYC document type")
+    if upload_data.purpose == "listing_video":
+        await owned_listing(upload_data.target, user_id)
+    try:
+        session = await create_upload_session(db, user_id, **upload_data.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return session_status(session)
+
+@api_router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, user_id: str = Depends(verify_token)):
+    return session_status(await get_upload_session(db, upload_id, user_id))
+
+@api_router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    user_id: str = Depends(verify_token)
+):
+    """Raw body bytes are streamed to disk; send any number of chunks, each at the current offset"""
+    return await append_chunk(db, upload_id, user_id, upload_offset, request)
+
+@api_router.post("/uploads/{upload_id}/complete")
+async def finish_upload(upload_id: str, user_id: str = Depends(verify_token)):
+    session = await complete_upload(db, upload_id, user_id)
+    document = {
+        "file": session.get("file"),
+        "filename": session.get("filename"),
+        "content_type": session["content_type"],
+        "size": session["size"],
+        "uploaded_at": datetime.utcnow()
+    }
+    # Both writes are idempotent, so retrying /complete after a timeout is safe
+    if session["purpose"] == "kyc_document":
+        await db.users.update_one(
+            {"id": user_id},
+            {"$set": {f"kyc_documents.{session['target']}": document, "kyc_status": "pending", "updated_at": datetime.utcnow()}}
+        )
+        invalidate_user_caches(user_id)
+        return {"purpose": session["purpose"], "target": session["target"], "kyc_status": "pending"}
+    
+    listing = await owned_listing(session["target"], user_id)
+    await db.listings.update_one(
+        {"_id": listing["_id"]},
+        {"$addToSet": {"videos": session["url"]}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    return {"purpose": session["purpose"], "target": session["target"], "url": session["url"]}
+
+# Review Routes
+@api_router.get("/users/{seller_id}/public-profile")
+async def get_public_profile(seller_id: str):
+    profile = await get_seller_profile(db, seller_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="User not found")
+    return profile
+
+@api_router.get("/users/{seller_id}/reviews")
+async def list_seller_reviews(seller_id: str, limit: int = 20, before: Optional[datetime] = None):
+    limit = max(1, min(limit, 50))
+    reviews = await get_seller_reviews(db, seller_id, limit, before)
+    reviewers = await user_summaries.get_many(db, [review["reviewer_id"] for review in reviews])
+    for review in reviews:
+        review["id"] = review.pop("_id")
+        reviewer = reviewers.get(review["reviewer_id"])
+        review["reviewer"] = {
+            "id": review["reviewer_id"],
+            "name": reviewer["name"] if reviewer else "Bilinmeyen Kullanıcı",
+            "profile_image": reviewer["profile_image"] if reviewer else None
+        }
+    return {
+        "reviews": reviews,
+        "next_before": reviews[-1]["created_at"] if len(reviews) == limit else None
+    }
+
+@api_router.post("/users/{seller_id}/reviews")
+async def post_review(seller_id: str, review_data: ReviewCreate, user_id: str = Depends(verify_token)):
+    try:
+        review = await create_review(db, user_id, seller_id, review_data.listing_id, review_data.rating, review_data.comment)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    reviewer = await user_summaries.get(db, user_id)
+    await notification_jobs.submit(
+        create_notification,
+        db=db,
+        user_id=seller_id,
+        notification_type=NotificationType.PROFILE,
+        priority=NotificationPriority.LOW,
+        title="Yeni Değerlendirme",
+        message=f"{reviewer['name'] if reviewer else 'Bir alıcı'} size {review['rating']} yıldız verdi",
+        data={"review_id": review["_id"], "listing_id": review["listing_id"]},
+        dedupe_key=f"review:{review['_id']}"
+    )
+    review["id"] = review.pop("_id")
+    return review
+
+@api_router.delete("/reviews/{review_id}")
+async def remove_review(review_id: str, user_id: str = Depends(verify_token)):
+    if not await delete_review(db, review_id, user_id):
+        raise HTTPException(status_code=404, detail="Review not found")
+    return {"message": "Review deleted"}
+
+# Saved Searches Routes
+@api_router.post("/saved-searches")
+async def save_search(search_data: SavedSearchCreate, user_id: str = Depends(verify_token)):
+    """Save a search; new matching listings will notify the user"""
+    filters = search_data.filters.dict(exclude_none=True)
+    if not filters:
+        raise HTTPException(status_code=400, detail="At least one filter is required")
+    if await db.saved_searches.count_documents({"user_id": user_id}) >= MAX_SAVED_SEARCHES_PER_USER:
+        raise HTTPException(status_code=400, detail=f"You can save at most {MAX_SAVED_SEARCHES_PER_USER} searches")
+    
+    saved_search = await create_saved_search(db, user_id, filters, name=search_data.name)
+    saved_search["id"] = saved_search.pop("_id")
+    saved_search.pop("anchor", None)
+    return saved_search
+
+@api_router.get("/saved-searches")
+async def get_saved_searches(user_id: str = Depends(verify_token)):
+    """List the caller's saved searches"""
+    saved_searches = await db.saved_searches.find({"user_id": user_id}, {"anchor": 0}).sort("created_at", -1).to_list(MAX_SAVED_SEARCHES_PER_USER)
+    for saved_search in saved_searches:
+        saved_search["id"] = saved_search.pop("_id")
+    return saved_searches
+
+@api_router.delete("/saved-searches/{search_id}")
+async def delete_saved_search(search_id: str, user_id: str = Depends(verify_token)):
+    """Delete one of the caller's saved searches"""
+    result = await db.saved_searches.delete_one({"_id": search_id, "user_id": user_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Saved search not found")
+    return {"status": "success", "message": "Saved search deleted"}
+
+# Offers Routes
+@api_router.get("/listings/{listing_id}/offers")
+async def get_offers_for_listing(
+    listing_id: str,
+    status: Optional[str] = None,
+    user_id: str = Depends(verify_token)
+):
+    """List offers on a listing, highest first (seller only)"""
+    listing = await find_listing(listing_id)
+    if not listing:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    if listing["seller_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    offers = await get_listing_offers(db, listing["_id"], status=status)
+    for offer in offers:
+        offer["id"] = offer.pop("_id")
+        offer.pop("listing_key", None)
+    
+    return {"best_offer": listing.get("best_offer"), "open_offers": listing.get("open_offers", 0), "offers": offers}
+
+async def change_offer_status(offer_id: str, user_id: str, new_status: OfferStatus):
+    try:
+        offer = await transition_offer(db, offer_id, user_id, new_status)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not offer:
+        raise HTTPException(status_code=404, detail="Offer not found")
+    
+    if new_status == OfferStatus.ACCEPTED:
+        title = "Teklifiniz Kabul Edildi"
+        message = f"{offer['amount']:,.0f} TL teklifiniz satıcı tarafından kabul edildi"
+    else:
+        title = "Teklifiniz Reddedildi"
+        message = f"{offer['amount']:,.0f} TL teklifiniz satıcı tarafından reddedildi"
+    
+    await notification_jobs.submit(
+        create_notification,
+        db=db,
+        user_id=offer["buyer_id"],
+        notification_type=NotificationType.OFFER,
+        priority=NotificationPriority.HIGH,
+        title=title,
+        message=message,
+        data={"offer_id": offer_id, "listing_id": offer["listing_id"], "status": new_status.value},
+        dedupe_key=f"offer:{offer_id}:{new_status.value}"
+    )
+    
+    return {"status": "success", "offer_id": offer_id, "offer_status": new_status.value}
+
+@api_router.put("/offers/{offer_id}/accept")
+async def accept_offer(offer_id: str, user_id: str = Depends(verify_token)):
+    """Accept an open offer (seller only)"""
+    return await change_offer_status(offer_id, user_id, OfferStatus.ACCEPTED)
+
+@api_router.put("/offers/{offer_id}/reject")
+async def reject_offer(offer_id: str, user_id: str = Depends(verify_token)):
+    """Reject an open offer (seller only)"""
+    return await change_offer_status(offer_id, user_id, OfferStatus.REJECTED)
+
 @api_router.delete("/conversations/{conversation_id}")
 async def delete_conversation(
     conversation_id: str,
@@ -894,36 +1272,92 @@ async def delete_conversation(
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     # Delete all messages in this conversation for this user
-    result = await db.messages.delete_many({
+    conversation_query = {
         "$or": [
             {"sender_id": user_id, "conversation_id": conversation_id},
             {"receiver_id": user_id, "conversation_id": conversation_id}
         ]
-    })
+    }
+    message_ids = [message["id"] async for message in db.messages.find(conversation_query, {"id": 1}) if message.get("id")]
+    result = await db.messages.delete_many(conversation_query)
+    await remove_from_search(db, message_ids)
     
-    print(f"💬 Deleted {result.deleted_count} messages from conversation {conversation_id}")
+    logger.info("Deleted conversation messages", extra={"conversation_id": conversation_id, "deleted": result.deleted_count})
     return {"status": "success", "message": f"Deleted {result.deleted_count} messages"}
 
 # Notifications Routes
+# Fields a client may ask for with ?fields=; id, created_at and updated_at always come back for cursors
+NOTIFICATION_FIELDS = {"user_id", "type", "priority", "title", "message", "data", "status", "is_email_sent", "is_push_sent", "read_at", "coalesced_count", "updated_at"}
+
+def after_cursor(field: str, value: datetime, last_id: Optional[str], direction: int) -> Dict[str, Any]:
+    """(field, _id) keyset condition, so items sharing a timestamp are not skipped at page boundaries"""
+    op = "$gt" if direction == 1 else "$lt"
+    if not last_id:
+        return {field: {op: value}}
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: last_id}}]}
+
 @api_router.get("/notifications")
 async def get_notifications(
     user_id: str = Depends(verify_token),
     status: Optional[str] = None,
-    limit: int = 50
+    limit: int = 50,
+    include_archived: bool = False,
+    since: Optional[datetime] = None,
+    since_id: Optional[str] = None,
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
+    fields: Optional[str] = None
 ):
-    """Get user notifications with optional status filter"""
-    query = {"user_id": user_id}
+    """Get user notifications, newest first.
+    
+    `before` + `before_id` (created_at and id of the last item seen) page back through older
+    items. `since` + `since_id` (updated_at and id of the last item seen) return items created
+    or coalesced after that point, oldest first in the page, so repeated polls leave no gaps.
+    `fields` is a comma separated list for sparse responses.
+    """
+    limit = max(1, min(limit, 100))
+    query: Dict[str, Any] = {"user_id": user_id}
     if status:
         query["status"] = status
     
-    notifications = await db.notifications.find(query).sort("created_at", -1).limit(limit).to_list(limit)
+    conditions = []
+    if since:
+        conditions.append(after_cursor("updated_at", since, since_id, 1))
+    if before:
+        conditions.append(after_cursor("created_at", before, before_id, -1))
+    if len(conditions) == 1:
+        query.update(conditions[0])
+    elif conditions:
+        query["$and"] = conditions
+    
+    if fields:
+        requested = {field.strip() for field in fields.split(",")} & NOTIFICATION_FIELDS
+        projection = {field: 1 for field in requested}
+        projection["created_at"] = 1
+        projection["updated_at"] = 1
+    else:
+        projection = {"outbox": 0, "coalesce_key": 0, "coalesce_open": 0, "coalesce_until": 0}
+    
+    # Served by the (user_id, updated_at, _id) and (user_id, created_at, _id) indexes
+    sort_field, sort_direction = ("updated_at", 1) if since and not before else ("created_at", -1)
+    sort = [(sort_field, sort_direction), ("_id", sort_direction)]
+    notifications = await db.notifications.find(query, projection).sort(sort).limit(limit).to_list(limit)
+    if include_archived:
+        archived = await find_archived_notifications(db, query, limit, projection, sort_direction, sort_field)
+        notifications = sorted(
+            notifications + archived,
+            key=lambda n: (n.get(sort_field) or n["created_at"], n["_id"]),
+            reverse=sort_direction == -1
+        )[:limit]
+    if sort_direction == 1:
+        notifications.reverse()
     
     # Handle ObjectId conversion
     for notification in notifications:
         notification["id"] = str(notification["_id"])
         notification.pop("_id", None)
     
-    print(f"🔔 Retrieved {len(notifications)} notifications for user {user_id}")
+    logger.debug("Retrieved notifications", extra={"user_id": user_id, "count": len(notifications)})
     return notifications
 
 @api_router.put("/notifications/{notification_id}/read")
@@ -932,20 +1366,23 @@ async def mark_notification_read(
     user_id: str = Depends(verify_token)
 ):
     """Mark a specific notification as read"""
-    result = await db.notifications.update_one(
+    previous = await db.notifications.find_one_and_update(
         {"_id": notification_id, "user_id": user_id},
         {
             "$set": {
                 "status": NotificationStatus.READ,
                 "read_at": datetime.utcnow()
             }
-        }
+        },
+        projection={"status": 1}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Notification not found")
+    if previous["status"] == NotificationStatus.UNREAD:
+        await adjust_unread_notifications(db, user_id, -1)
     
-    print(f"🔔 Marked notification {notification_id} as read")
+    logger.debug("Marked notification as read", extra={"notification_id": notification_id})
     return {"status": "success", "message": "Notification marked as read"}
 
 @api_router.put("/notifications/read-all")
@@ -961,24 +1398,81 @@ async def mark_all_notifications_read(user_id: str = Depends(verify_token)):
         }
     )
     
-    print(f"🔔 Marked {result.modified_count} notifications as read for user {user_id}")
+    await adjust_unread_notifications(db, user_id, -result.modified_count)
+    
+    logger.debug("Marked all notifications as read", extra={"user_id": user_id, "modified": result.modified_count})
     return {"status": "success", "message": f"Marked {result.modified_count} notifications as read"}
 
 @api_router.get("/notifications/unread-count")
 async def get_unread_count(user_id: str = Depends(verify_token)):
     """Get count of unread notifications"""
-    count = await db.notifications.count_documents({
-        "user_id": user_id,
-        "status": NotificationStatus.UNREAD
-    })
-    
-    print(f"🔔 User {user_id} has {count} unread notifications")
+    count = await get_unread_notification_count(db, user_id)
     return {"unread_count": count}
 
+@api_router.get("/notifications/stream")
+async def stream_notifications(
+    user_id: str = Depends(verify_token),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Server-Sent Events: new notifications and unread-count changes, with heartbeats.
+
+    The connection subscribes before the replay query runs, so nothing published in between is
+    lost; live events buffer in the queue and those the replay already sent are skipped by id.
+    A `resync` event means more was missed than REPLAY_LIMIT; reload via GET /notifications.
+    """
+    queue = notification_streams.connect(user_id)
+    
+    async def event_source():
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            
+            # Resume: replay what was created while the client was away
+            resume = parse_event_id(last_event_id) if last_event_id else None
+            replayed: Set[str] = set()
+            if resume:
+                since, since_id = resume
+                # Same (created_at, _id) keyset as GET /notifications, so a tie in one millisecond is not skipped
+                missed = await db.notifications.find(
+                    {"user_id": user_id, **after_cursor("created_at", since, since_id, 1)}
+                ).sort([("created_at", 1), ("_id", 1)]).limit(REPLAY_LIMIT + 1).to_list(REPLAY_LIMIT + 1)
+                for notification in missed[:REPLAY_LIMIT]:
+                    replayed.add(str(notification["_id"]))
+                    yield format_event(
+                        "notification",
+                        notification_payload(notification),
+                        event_id_for(notification["created_at"], notification["_id"])
+                    )
+                if len(missed) > REPLAY_LIMIT:
+                    # More was missed than a replay carries: the client reloads its list over REST
+                    yield format_event("resync", {"reason": "replay_limit", "replayed": REPLAY_LIMIT})
+            
+            count = await get_unread_notification_count(db, user_id)
+            yield format_event("unread_count", {"unread_count": count})
+            
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if message is None:
+                    break
+                key, text = message
+                if key in replayed:
+                    continue
+                yield text
+        finally:
+            notification_streams.disconnect(user_id, queue)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/notifications/settings", response_model=NotificationSettings)
 async def get_notification_settings(user_id: str = Depends(verify_token)):
     """Get user notification settings"""
-    from notification_service import get_user_notification_settings
     settings = await get_user_notification_settings(db, user_id)
     
     # Ensure id is set properly
@@ -1002,8 +1496,9 @@ async def update_notification_settings(
         {"$set": settings_dict},
         upsert=True
     )
+    invalidate_notification_settings(user_id)
     
-    print(f"🔧 Updated notification settings for user {user_id}")
+    logger.info("Updated notification settings", extra={"user_id": user_id})
     return {"status": "success", "message": "Notification settings updated"}
 
 @api_router.delete("/notifications/{notification_id}")
@@ -1012,24 +1507,33 @@ async def delete_notification(
     user_id: str = Depends(verify_token)
 ):
     """Delete a specific notification"""
-    result = await db.notifications.delete_one({
-        "_id": notification_id,
-        "user_id": user_id
-    })
+    deleted = await db.notifications.find_one_and_delete(
+        {"_id": notification_id, "user_id": user_id},
+        projection={"status": 1}
+    )
     
-    if result.deleted_count == 0:
+    if deleted is None:
+        if await delete_archived_notifications(db, {"_id": notification_id, "user_id": user_id}):
+            return {"status": "success", "message": "Notification deleted"}
         raise HTTPException(status_code=404, detail="Notification not found")
+    if deleted["status"] == NotificationStatus.UNREAD:
+        await adjust_unread_notifications(db, user_id, -1)
     
-    print(f"🗑️ Deleted notification {notification_id}")
+    logger.debug("Deleted notification", extra={"notification_id": notification_id})
     return {"status": "success", "message": "Notification deleted"}
 
 @api_router.delete("/notifications")
 async def delete_all_notifications(user_id: str = Depends(verify_token)):
     """Delete all notifications for user"""
+    # Unread ones first so the counter moves by exactly what was removed
+    unread_result = await db.notifications.delete_many({"user_id": user_id, "status": NotificationStatus.UNREAD})
+    await adjust_unread_notifications(db, user_id, -unread_result.deleted_count)
     result = await db.notifications.delete_many({"user_id": user_id})
+    archived_count = await delete_archived_notifications(db, {"user_id": user_id})
+    deleted_count = unread_result.deleted_count + result.deleted_count + archived_count
     
-    print(f"🗑️ Deleted {result.deleted_count} notifications for user {user_id}")
-    return {"status": "success", "message": f"Deleted {result.deleted_count} notifications"}
+    logger.info("Deleted all notifications", extra={"user_id": user_id, "deleted": deleted_count})
+    return {"status": "success", "message": f"Deleted {deleted_count} notifications"}
 
 @api_router.post("/notifications/test")
 async def test_notification(user_id: str = Depends(verify_token)):
@@ -1046,20 +1550,138 @@ async def test_notification(user_id: str = Depends(verify_token)):
     
     return {"status": "success", "message": "Test notification sent"}
 
+# Background maintenance jobs
+UNREAD_RECONCILE_INTERVAL = int(os.environ.get('UNREAD_RECONCILE_INTERVAL', 3600))
+OFFER_EXPIRY_INTERVAL = int(os.environ.get('OFFER_EXPIRY_INTERVAL', 900))
+NOTIFICATION_RECONCILE_INTERVAL = int(os.environ.get('NOTIFICATION_RECONCILE_INTERVAL', 3600))
+NOTIFICATION_ARCHIVE_INTERVAL = int(os.environ.get('NOTIFICATION_ARCHIVE_INTERVAL', 86400))
+UPLOAD_EXPIRY_INTERVAL = int(os.environ.get('UPLOAD_EXPIRY_INTERVAL', 3600))
+REVOCATION_REFRESH_INTERVAL = int(os.environ.get('REVOCATION_REFRESH_INTERVAL', 60))
+background_tasks: List[asyncio.Task] = []
+
+async def run_periodically(job, interval_seconds: int):
+    """Run a maintenance job forever, logging failures instead of dying"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await job(db)
+        except Exception:
+            logger.exception("Background job failed", extra={"job": job.__name__})
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_db():
     await create_indexes()
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    await notification_jobs.start()
+    await outbox_dispatcher.start(db)
+    await delivery_scheduler.start(db, release_deferred_notifications)
+    await load_revocations(db)
+    await metrics_registry.start()
+    # Returns at once when finished; otherwise resumes from its checkpoint
+    background_tasks.append(asyncio.create_task(backfill_message_search(db)))
+    background_tasks.append(asyncio.create_task(run_periodically(reconcile_unread_counters, UNREAD_RECONCILE_INTERVAL)))
+    background_tasks.append(asyncio.create_task(run_periodically(expire_offers, OFFER_EXPIRY_INTERVAL)))
+    background_tasks.append(asyncio.create_task(run_periodically(reconcile_unread_notifications, NOTIFICATION_RECONCILE_INTERVAL)))
+    background_tasks.append(asyncio.create_task(run_periodically(archive_notifications, NOTIFICATION_ARCHIVE_INTERVAL)))
+    background_tasks.append(asyncio.create_task(run_periodically(load_revocations, REVOCATION_REFRESH_INTERVAL)))
+    background_tasks.append(asyncio.create_task(run_periodically(expire_upload_sessions, UPLOAD_EXPIRY_INTERVAL)))
+
+# /metrics is outside /api: scrapers authenticate with this token, or only private networks get in
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Values read from the subsystems only when /metrics is scraped
+metrics_registry.add_collector("password_hasher", lambda: {
+    "workers": password_hasher.workers,
+    "pending": password_hasher.pending,
+    "completed_total": password_hasher.completed,
+    "rejected_total": password_hasher.rejected
+}, {
+    "workers": ("gauge", "bcrypt worker threads"),
+    "pending": ("gauge", "Hash and verify calls running or waiting for a worker"),
+    "completed_total": ("counter", "Hash and verify calls completed"),
+    "rejected_total": ("counter", "Hash and verify calls refused because the queue was full")
+})
+metrics_registry.add_collector("notification_jobs", lambda: {
+    "queued": notification_jobs.stats()["queued"],
+    "workers": notification_jobs.stats()["workers"],
+    "processed_total": notification_jobs.processed,
+    "failed_total": notification_jobs.failed,
+    "retried_total": notification_jobs.retried
+}, {
+    "queued": ("gauge", "Notification jobs waiting for a worker"),
+    "workers": ("gauge", "Notification job workers running"),
+    "processed_total": ("counter", "Notification jobs completed"),
+    "failed_total": ("counter", "Notification jobs that failed for good"),
+    "retried_total": ("counter", "Notification job retries")
+})
+metrics_registry.add_collector("notification_streams", lambda: {
+    "connections": notification_streams.connection_count(),
+    "dropped_total": notification_streams.dropped
+}, {
+    "connections": ("gauge", "Open SSE connections"),
+    "dropped_total": ("counter", "SSE connections ended because the client fell behind")
+})
+metrics_registry.add_collector("notification_outbox", lambda: {
+    **{f'{key}_total{{channel="{channel}"}}': count for key in ("sent", "failed") for channel, count in outbox_dispatcher.stats()[key].items()},
+    "batches_total": outbox_dispatcher.stats()["batches"]
+}, {
+    "sent_total": ("counter", "Notifications delivered by channel"),
+    "failed_total": ("counter", "Notifications given up on after the last retry, by channel"),
+    "batches_total": ("counter", "Provider batches sent")
+})
+metrics_registry.add_collector("rate_limit", lambda: {
+    f'rejected_total{{policy="{policy}"}}': count for policy, count in rate_limiter.rejected.items()
+}, {
+    "rejected_total": ("counter", "Requests refused with 429 by policy")
+})
+metrics_registry.add_collector("mongo", command_listener.stats, {
+    "commands_total": ("counter", "Mongo commands by command name"),
+    "slow_commands_total": ("counter", "Mongo commands slower than MONGO_SLOW_COMMAND_MS"),
+    "failed_commands_total": ("counter", "Mongo commands that failed")
+})
+metrics_registry.add_collector("log", lambda: {"dropped_total": dropped_log_records()}, {
+    "dropped_total": ("counter", "Log records dropped because the log queue was full")
+})
+
+PROXY_HEADERS = ("x-forwarded-for", "forwarded", "x-real-ip")
+
+def metrics_allowed(request: Request) -> bool:
+    """Scrapers send METRICS_TOKEN as a bearer token. Without one configured, only direct local requests may scrape.
+
+    Behind a reverse proxy every client arrives from the proxy's (private or loopback) address, so
+    the network check only uses private ranges when RATE_LIMIT_TRUST_PROXY says client_ip is real;
+    otherwise a request that came through a proxy is refused.
+    """
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}")
+    try:
+        address = ipaddress.ip_address(client_ip(request))
+    except ValueError:
+        return False
+    if TRUST_FORWARDED_FOR:
+        return address.is_loopback or address.is_private
+    return address.is_loopback and not any(header in request.headers for header in PROXY_HEADERS)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if not metrics_allowed(request):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 app.include_router(api_router)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# Uploaded media; documents store these URLs instead of base64 blobs
+app.mount(MEDIA_URL_PREFIX, StaticFiles(directory=UPLOAD_DIR, check_dir=False), name="media")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await notification_jobs.drain()
+    await delivery_scheduler.stop()
+    await outbox_dispatcher.stop()
+    await metrics_registry.stop()
+    password_hasher.shutdown()
+    image_executor.shutdown(wait=False)
+    stop_logging()
     client.close()
\ No newline at end of file
@@ -0,0 +1,81 @@
+# User Summary Cache for HayvanPazarı
+from typing import Dict, Any, Optional, Iterable
+
+from ttl_cache import TTLCache
+
+# Only what chat and notifications display; never the password hash
+USER_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "first_name": 1,
+    "last_name": 1,
+    "profile_image": 1,
+    "email": 1
+}
+
+
+def build_summary(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": user["id"],
+        "first_name": user.get("first_name", ""),
+        "last_name": user.get("last_name", ""),
+        "name": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
+        "profile_image": user.get("profile_image"),
+        "email": user.get("email")
+    }
+
+
+class UserSummaryCache:
+    """Bounded LRU of user summaries (id → name, avatar, email) with a TTL, loaded from db on a miss"""
+
+    def __init__(self, maxsize: int = 5000, ttl_seconds: float = 300):
+        self._cache = TTLCache(maxsize=maxsize, ttl_seconds=ttl_seconds)
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    async def get(self, db, user_id: str) -> Optional[Dict[str, Any]]:
+        """Summary for one user, loading it with a projection on a miss"""
+        summary = self._cache.get(user_id)
+        if summary is not None:
+            return summary
+
+        user = await db.users.find_one({"id": user_id}, USER_SUMMARY_PROJECTION)
+        if not user:
+            return None
+        summary = build_summary(user)
+        self._cache.set(user_id, summary)
+        return summary
+
+    async def get_many(self, db, user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Summaries for many users with a single $in query for the misses"""
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for user_id in set(user_ids):
+            summary = self._cache.get(user_id)
+            if summary is not None:
+                found[user_id] = summary
+            else:
+                missing.append(user_id)
+
+        if missing:
+            async for user in db.users.find({"id": {"$in": missing}}, USER_SUMMARY_PROJECTION):
+                summary = build_summary(user)
+                self._cache.set(summary["id"], summary)
+                found[summary["id"]] = summary
+        return found
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Shared by server.py and notification_service.py
+user_summaries = UserSummaryCache()
@@ -0,0 +1,37 @@
+# Query shape tests for HayvanPazarı (no database: shapes are computed from command documents)
+from db_instrumentation import QueryStats, filter_shape, shape_key
+
+
+def test_values_are_hidden():
+    assert filter_shape({"user_id": "u1", "created_at": {"$gt": 5}}) == {"user_id": "?", "created_at": {"$gt": "?"}}
+
+def test_in_lists_of_any_length_share_a_shape():
+    assert filter_shape({"id": {"$in": ["a"]}}) == filter_shape({"id": {"$in": ["a", "b", "c"]}})
+
+def test_every_or_clause_is_shaped():
+    shape = filter_shape({"$or": [{"sender_id": "a"}, {"receiver_id": "b"}]})
+    assert shape == {"$or": ["{'receiver_id': '?'}", "{'sender_id': '?'}"]}
+
+def test_or_clause_order_and_repeats_do_not_split_a_shape():
+    first = filter_shape({"$or": [{"a": 1}, {"b": 2}]})
+    assert filter_shape({"$or": [{"b": 3}, {"a": 4}, {"a": 5}]}) == first
+    assert filter_shape({"$or": [{"a": 1}]}) != first
+
+def test_deep_filters_are_cut_off():
+    deep = {"a": {"b": {"c": {"d": {"e": {"f": 1}}}}}}
+    assert filter_shape(deep) == {"a": {"b": {"c": {"d": {"e": "…"}}}}}
+
+def test_shape_key_reads_each_command_filter():
+    assert shape_key("find", "users", {"find": "users", "filter": {"id": "x"}}) == ("find", "users", "{'id': '?'}")
+    assert shape_key("update", "users", {"update": "users", "updates": [{"q": {"id": "x"}}]})[2] == "{'id': '?'}"
+    assert shape_key("aggregate", "messages", {"pipeline": [{"$match": {"receiver_id": "u"}}]})[2] == "{'receiver_id': '?'}"
+    assert shape_key("insert", "messages", {"documents": [{}]})[2] == ""
+
+def test_repeated_shapes_are_reported():
+    stats = QueryStats()
+    key = shape_key("find", "listings", {"filter": {"id": "x"}})
+    for _ in range(3):
+        stats.record(key, 0.001)
+    stats.record(shape_key("find", "users", {"filter": {"id": "x"}}), 0.001)
+    assert stats.count == 4
+    assert stats.repeated(threshold=3) == [(key, 3)]
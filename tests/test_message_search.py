@@ -0,0 +1,26 @@
+# Message search tests for HayvanPazarı (no database: folding and the documents that get indexed)
+from message_search import fold_turkish, search_documents
+
+
+def test_turkish_letters_fold_to_ascii():
+    assert fold_turkish("Şimşek") == fold_turkish("simsek") == fold_turkish("SİMŞEK") == "simsek"
+    assert fold_turkish("çğıöşü ÇĞIÖŞÜ") == "cgiosu cgiosu"
+
+def test_dotted_and_dotless_i_both_become_i():
+    assert fold_turkish("Irmak ısırgan İnek") == "irmak isirgan inek"
+
+def test_circumflex_vowels_fold():
+    assert fold_turkish("Kâğıt hâlâ") == "kagit hala"
+
+def test_thousands_separators_are_dropped():
+    assert fold_turkish("30.000 TL ya da 30,000") == "30000 tl ya da 30000"
+    # Decimals and plain sentences keep their punctuation
+    assert fold_turkish("2.5 yaşında. 100 baş") == "2.5 yasinda. 100 bas"
+
+def test_one_search_document_per_participant():
+    documents = search_documents({
+        "id": "m1", "sender_id": "s", "receiver_id": "r", "listing_id": "l",
+        "message": "Teklif", "offer_amount": 85000.0
+    })
+    assert [(doc["_id"], doc["owner_id"], doc["peer_id"]) for doc in documents] == [("m1:s", "s", "r"), ("m1:r", "r", "s")]
+    assert all(doc["text"] == "teklif 85000" for doc in documents)
@@ -0,0 +1,56 @@
+# Notification rule tests for HayvanPazarı (no database: coalescing keys and quiet hours)
+from datetime import datetime
+
+from notification_service import (
+    DEFAULT_NOTIFICATION_SETTINGS,
+    NotificationPriority,
+    NotificationType,
+    coalesce_key,
+    deferred_until,
+    is_quiet_hours,
+    new_notification_doc,
+)
+
+CHAT = {"sender_id": "s1", "listing_id": "l1"}
+
+
+def settings(**overrides):
+    return {**DEFAULT_NOTIFICATION_SETTINGS, "quiet_hours_enabled": True, **overrides}
+
+
+def test_messages_and_offers_coalesce_per_sender_listing_and_type():
+    assert coalesce_key("u1", NotificationType.MESSAGE, CHAT) == "u1:s1:l1:message"
+    assert coalesce_key("u1", NotificationType.OFFER, CHAT) == "u1:s1:l1:offer"
+    assert coalesce_key("u2", NotificationType.MESSAGE, CHAT) != coalesce_key("u1", NotificationType.MESSAGE, CHAT)
+
+def test_other_types_and_incomplete_data_do_not_coalesce():
+    assert coalesce_key("u1", NotificationType.LISTING, CHAT) is None
+    assert coalesce_key("u1", NotificationType.MESSAGE, {"sender_id": "s1"}) is None
+    assert coalesce_key("u1", NotificationType.MESSAGE, None) is None
+
+def test_dedupe_key_gives_a_stable_id():
+    first = new_notification_doc("u1", NotificationType.MESSAGE, NotificationPriority.HIGH, "t", "m", dedupe_key="message:m1")
+    again = new_notification_doc("u1", NotificationType.MESSAGE, NotificationPriority.HIGH, "t", "m", dedupe_key="message:m1")
+    other = new_notification_doc("u2", NotificationType.MESSAGE, NotificationPriority.HIGH, "t", "m", dedupe_key="message:m1")
+    assert first["_id"] == again["_id"] == "message:m1:u1"
+    assert other["_id"] != first["_id"]
+
+def test_quiet_hours_follow_the_users_timezone():
+    # 20:30 UTC is 23:30 in Istanbul (UTC+3, no DST)
+    assert is_quiet_hours(settings(), datetime(2026, 1, 10, 20, 30))
+    assert not is_quiet_hours(settings(timezone="UTC"), datetime(2026, 1, 10, 20, 30))
+    assert not is_quiet_hours(settings(quiet_hours_enabled=False), datetime(2026, 1, 10, 20, 30))
+
+def test_deferred_until_the_end_of_quiet_hours():
+    # 23:30 Istanbul: held until 08:00 Istanbul the next morning, 05:00 UTC
+    assert deferred_until(settings(), NotificationPriority.HIGH, datetime(2026, 1, 10, 20, 30)) == datetime(2026, 1, 11, 5, 0)
+    # 02:00 Istanbul (23:00 UTC the day before): the same morning
+    assert deferred_until(settings(), NotificationPriority.HIGH, datetime(2026, 1, 10, 23, 0)) == datetime(2026, 1, 11, 5, 0)
+
+def test_quiet_hours_within_one_day():
+    daytime = settings(quiet_hours_start="13:00", quiet_hours_end="14:00", timezone="UTC")
+    assert deferred_until(daytime, NotificationPriority.LOW, datetime(2026, 1, 10, 13, 30)) == datetime(2026, 1, 10, 14, 0)
+    assert deferred_until(daytime, NotificationPriority.LOW, datetime(2026, 1, 10, 15, 0)) is None
+
+def test_critical_notifications_are_never_deferred():
+    assert deferred_until(settings(), NotificationPriority.CRITICAL, datetime(2026, 1, 10, 20, 30)) is None
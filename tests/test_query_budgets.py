@@ -0,0 +1,119 @@
+# Query budget tests for HayvanPazarı
+#
+# Mongo commands are counted by the pymongo command listener, so these need a real server
+# (TEST_MONGO_URL, default mongodb://localhost:27017); they are skipped when none answers.
+import os
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+TEST_MONGO_URL = os.environ.get('TEST_MONGO_URL', 'mongodb://localhost:27017')
+TEST_DB_NAME = f"hayvanpazari_test_{uuid.uuid4().hex[:8]}"
+
+
+def mongo_available() -> bool:
+    try:
+        MongoClient(TEST_MONGO_URL, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not mongo_available(), reason=f"MongoDB not reachable at {TEST_MONGO_URL}")
+
+
+@pytest.fixture(scope="module")
+def client():
+    os.environ['MONGO_URL'] = TEST_MONGO_URL
+    os.environ['DB_NAME'] = TEST_DB_NAME
+    from fastapi.testclient import TestClient
+    import server
+
+    # Startup creates the indexes and starts the job workers the handlers rely on
+    with TestClient(server.app) as test_client:
+        yield test_client
+    MongoClient(TEST_MONGO_URL).drop_database(TEST_DB_NAME)
+
+
+def register(client, name: str):
+    suffix = uuid.uuid4().hex[:8]
+    response = client.post("/api/auth/register", json={
+        "email": f"{name}-{suffix}@example.com",
+        "phone": f"+90555{suffix}",
+        "password": "secret-password",
+        "first_name": name,
+        "last_name": "Test"
+    })
+    assert response.status_code == 200, response.text
+    body = response.json()
+    return body["user"]["id"], {"Authorization": f"Bearer {body['access_token']}"}
+
+
+@pytest.fixture(scope="module")
+def conversation(client):
+    seller_id, seller_auth = register(client, "seller")
+    buyer_id, buyer_auth = register(client, "buyer")
+    response = client.post("/api/listings", headers=seller_auth, json={
+        "title": "Simental düve",
+        "description": "18 aylık, aşıları tam",
+        "category": "cattle",
+        "animal_details": {"breed": "Simental", "age_months": 18},
+        "price": 85000,
+        "location": {"city": "Konya", "district": "Meram"}
+    })
+    assert response.status_code == 200, response.text
+    listing = response.json()
+    # The first message seeds the unread counters; the budgets below are for the steady state
+    response = client.post("/api/messages", headers=buyer_auth, json={
+        "listing_id": listing["id"], "receiver_id": seller_id, "message": "Merhaba"
+    })
+    assert response.status_code == 200, response.text
+    return {"seller_id": seller_id, "seller_auth": seller_auth, "buyer_id": buyer_id, "buyer_auth": buyer_auth, "listing": listing}
+
+
+def test_send_message_budget(client, conversation):
+    from db_instrumentation import assert_query_budget
+
+    # insert, conversation counter, user counter, search index
+    with assert_query_budget(4):
+        response = client.post("/api/messages", headers=conversation["buyer_auth"], json={
+            "listing_id": conversation["listing"]["id"],
+            "receiver_id": conversation["seller_id"],
+            "message": "Hâlâ satılık mı?"
+        })
+    assert response.status_code == 200, response.text
+
+
+def test_get_conversations_budget(client, conversation):
+    from db_instrumentation import assert_query_budget
+
+    # A second conversation, so a per-conversation listing lookup would show up as a repeated query
+    _, other_auth = register(client, "other")
+    client.post("/api/messages", headers=other_auth, json={
+        "listing_id": conversation["listing"]["id"], "receiver_id": conversation["seller_id"], "message": "Fiyat?"
+    })
+
+    # messages aggregate, unread counters, user summaries, listings — however many conversations
+    with assert_query_budget(4):
+        response = client.get("/api/messages/conversations", headers=conversation["seller_auth"])
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == 2
+    assert all(conv["listing"]["id"] == conversation["listing"]["id"] for conv in response.json())
+
+
+def test_get_listing_budget(client, conversation):
+    from db_instrumentation import assert_query_budget
+
+    # Lookup by the id field, then the view count
+    with assert_query_budget(3):
+        response = client.get(f"/api/listings/{conversation['listing']['id']}")
+    assert response.status_code == 200, response.text
+
+    # The id this endpoint returns is the ObjectId hex; it must not fall back to a collection scan
+    hex_id = response.json()["id"]
+    with assert_query_budget(4) as requests:
+        response = client.get(f"/api/listings/{hex_id}")
+    assert response.status_code == 200, response.text
+    assert not any(shape == "{}" for _, stats in requests for (_, _, shape) in stats.shapes)
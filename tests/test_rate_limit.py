@@ -0,0 +1,61 @@
+# Rate limit tests for HayvanPazarı (no database: the in-memory backend and a fixed clock)
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from rate_limit import MemoryRateLimitBackend, RateLimiter, RatePolicy, POLICIES, retry_after
+
+
+@pytest.fixture
+def policy():
+    policy = RatePolicy("test_policy", 5, 100)
+    POLICIES[policy.name] = policy
+    yield policy
+    POLICIES.pop(policy.name)
+
+
+def attempt(limiter: RateLimiter, now: float):
+    """None when allowed, otherwise the Retry-After seconds"""
+    try:
+        asyncio.run(limiter.check("test_policy", "subject", now=now))
+    except HTTPException as e:
+        assert e.status_code == 429
+        return int(e.headers["Retry-After"])
+    return None
+
+
+def test_under_limit_waits_for_previous_window_to_slide_out(policy):
+    # 4 this window, 4 last window, halfway through: 4 * 0.5 + 4 = 6 > 5
+    # One more fits once the previous window weighs nothing: 4 * 0 + 4 + 1 <= 5, 50s from now
+    assert retry_after(policy, 4, 4, 0.5) == 51
+    # 4 * (0.5 - x) + 3 + 1 <= 5 after a quarter window
+    assert retry_after(policy, 3, 4, 0.5) == 26
+
+
+def test_rejected_hits_extend_the_wait(policy):
+    # 8 hits counted in this window: at the next window start 8 * 1.0 + 1 is still over the limit,
+    # so the wait runs past it until 8 * (1 - x) + 1 <= 5, half way into the next window
+    assert retry_after(policy, 8, 0, 0.0) == 151
+    assert retry_after(policy, 16, 0, 0.75) == 25 + 75 + 1
+
+
+@pytest.mark.parametrize("hits", [6, 10, 25])
+def test_honoring_retry_after_is_never_rejected_again(policy, hits):
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    now = 1_000_000.0 + 30
+    waits = [attempt(limiter, now) for _ in range(hits)]
+    wait = waits[-1]
+    assert wait is not None
+
+    assert attempt(limiter, now + wait) is None
+
+
+def test_retry_after_is_not_early(policy):
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    now = 1_000_000.0 + 30
+    for _ in range(12):
+        wait = attempt(limiter, now)
+
+    # A second before the advertised time is still too early
+    assert attempt(RateLimiter(limiter.backend), now + wait - 1) is not None